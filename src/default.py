@@ -1,14 +1,26 @@
 # -*- coding: UTF-8 -*-
-import plugin
-import logging
 import sys
+from utils import service
 
-plugin.initialize('plugin.video.primewire', 'primewire')
+ADDON_ID = 'plugin.video.primewire'
 
-log = logging.getLogger("root")
-log.info("calling with args: %s" % str(sys.argv))
+# when the resident service is running it handles the request, otherwise we handle it here
+if not service.forwardInvocation(ADDON_ID):
+    import plugin
+    import logging
 
-try:
-    plugin.handle()
-except:
-    log.exception("Failed to handle request")
+    plugin.initialize(ADDON_ID, 'primewire')
+
+    log = logging.getLogger("root")
+    log.info("calling with args: %s" % str(sys.argv))
+
+    try:
+        plugin.handle()
+    except:
+        log.exception("Failed to handle request")
+
+    # this process ends with the request, so any work left in the background must finish now
+    from utils import background, deadlines
+
+    background.wait()
+    deadlines.saveStats()
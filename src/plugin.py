@@ -8,6 +8,9 @@ to either play or show a listing in XBMC's GUI.
 
 Handler functions must return a PluginResult which is a container for a list of results, with a
 size (for progress indication) and a iterable of PluginMovieItem instances(or generator function)
+Listing handlers can also return a StagedResult, whose items are made by a pipeline of stages that run
+at the same time (ie: fetch pages, extract items) and then load the items' metadata concurrently, on the threads
+that look up metadata (@see: lookupMetadata).
 
 A PluginMovieItem has a label a plugin mode and a map of arguments to use to invoke the 
 corresponding handler function with.
@@ -16,13 +19,63 @@ Created on Aug 7, 2010
 
 @author: pedro
 '''
-import inspect, logging
-import xbmcgui
+import inspect, logging, threading
 from metahandler.metahandlers import MetaData
-from utils import pluginsupport
-
-log = logging.getLogger("plugin")
-metadataFacade = MetaData()
+from utils import background, cache, deadlines, logs, mirrors, pipeline, pluginsupport, settings, storage
+
+log = logs.getLogger("plugin")
+
+"""how many threads look up metadata, so how many items of a StagedResult load their metadata at the same time"""
+ENRICH_WORKERS = 4
+"""how long, in seconds, the metadata of an item is reused without asking the metadata facade again"""
+METADATA_CACHE_TIME = 24 * 60 * 60
+
+# the metadata facade uses sqlite, whose connections can only be used by the thread that made them, so metadata
+# is looked up by a pool of threads that live as long as the process, each with a facade of its own
+_metadataFacades = threading.local()
+
+
+def _createMetadataFacade():
+    _metadataFacades.facade = MetaData()
+
+_metadataPool = pipeline.WorkerPool("metadata", ENRICH_WORKERS, _createMetadataFacade)
+
+
+def lookupMetadata(lookup, key=None):
+    """Look up metadata on one of the threads that have a metadata facade
+  Metadata looked up with a key is kept in the metadata cache, so that the next processes listing the same items
+  read it from there instead of opening the facade's database (@see: getMeta, getEpisodeMeta)
+  @param lookup: a function that looks up the metadata, called with the MetaData facade
+  @param key: the parts of the key to cache the metadata with (None to not cache it)
+  @return: what the lookup returned"""
+    if key:
+        key = "|".join(part.encode('utf-8') if isinstance(part, unicode) else str(part) for part in key)
+        metadata = cache.metadata.get(key)
+        if metadata is not None:
+            return metadata
+    metadata = _metadataPool.call(lambda: lookup(_metadataFacades.facade))
+    if key and metadata is not None:
+        cache.metadata.put(key, metadata, METADATA_CACHE_TIME)
+    return metadata
+
+
+def getMeta(mediaType, name):
+    """Get the metadata of a movie or a tv show
+  @param mediaType: the media type of the metadata facade ('movie' or 'tvshow')
+  @param name: the name of the movie or tv show
+  @return: the metadata dict"""
+    return lookupMetadata(lambda facade: facade.get_meta(mediaType, name), ('meta', mediaType, name))
+
+
+def getEpisodeMeta(showName, imdbid, season, episode):
+    """Get the metadata of an episode of a tv show
+  @param showName: the name of the tv show
+  @param imdbid: the imdb id of the tv show
+  @param season: the season of the episode
+  @param episode: the number of the episode
+  @return: the metadata dict"""
+    return lookupMetadata(lambda facade: facade.get_episode_meta(showName, imdbid, season, episode),
+                          ('episode', showName, imdbid, season, episode))
 
 class PluginContentType:
     MOVIES = 'movies'
@@ -35,16 +88,69 @@ class PluginResult:
         self.items = items
 
 
+class StagedResult(PluginResult):
+    """A PluginResult whose items are made by a pipeline (@see: utils.pipeline)
+  The handler's stages make PluginMovieItems out of the inputs, then a last stage loads their metadata
+  (ENRICH_WORKERS at a time), and the items are listed in order as they become ready."""
+
+    def __init__(self, size, inputs, stages, finish=None):
+        """Create a staged result
+    @param size: the expected number of items (for progress indication), 0 if unknown to count the items as the
+        stages make them
+    @param inputs: the inputs of the first stage
+    @param stages: the list of pipeline.Stage that make PluginMovieItems out of the inputs
+    @param finish: an optional function to call after all the items were made"""
+        PluginResult.__init__(self, size, self.__run)
+        self.inputs = inputs
+        self.stages = stages
+        self.finish = finish
+        self.__sizeLock = threading.Lock()
+
+    def __run(self):
+        # the stages run on other threads, for the invocation being handled by this one
+        bind = pluginsupport.bindInvocation
+        stages = [pipeline.Stage(stage.name, bind(stage.function), stage.workers, stage.expand, stage.pool)
+                  for stage in self.stages]
+        if not self.size:
+            stages[-1] = self.__counted(stages[-1])
+        stages.append(pipeline.Stage("enrich", bind(_enrich), pool=_metadataPool))
+        for item in pipeline.Pipeline(stages).run(self.inputs):
+            yield item
+        if self.finish:
+            self.finish()
+
+    def __counted(self, stage):
+        """wrap the handler's last stage to add the items it makes to the size of this result"""
+        def count(input):
+            made = stage.function(input)
+            if stage.expand:
+                made = list(made)
+            self.__sizeLock.acquire()
+            try:
+                self.size += len(made) if stage.expand else 1
+            finally:
+                self.__sizeLock.release()
+            return made
+        return pipeline.Stage(stage.name, count, stage.workers, stage.expand, stage.pool)
+
+
+def _enrich(item):
+    item.getListItemSpec()
+    return item
+
+
 class PluginMovieItem:
     """An item resolved by a plugin.
   Can be a link to a list of items or a playable item."""
     __listItem = None
+    __listItemSpec = None
 
-    def __init__(self, name, url, mode=None, extraArgs=None, season=None, episode=None):
+    def __init__(self, name, url, mode=None, extraArgs=None, season=None, episode=None, show=None):
         """Create an item
     @param name: the label for this item
     @param url: the url to load this item
-    @param mode: the mode for this link """
+    @param mode: the mode for this link
+    @param show: the url of the listing of the show's episodes (for episodes)"""
         self.label = name
         self.url = url
         self.mode = mode or "ROOT"
@@ -52,6 +158,7 @@ class PluginMovieItem:
         self.extraArgs = extraArgs
         self.season = season
         self.episode = episode
+        self.show = show
 
     def getMetadataLabels(self):
         """returns the metadata labels to use in XBMC's GUI"""
@@ -81,11 +188,12 @@ class PluginMovieItem:
     def buildContextMenu(self):
         pass
 
-    def getListItem(self):
-        """Create a list item for XBMC for this PluginMovieItem
-    @return the list item for XBMC"""
-        if self.__listItem:
-            return self.__listItem
+    def getListItemSpec(self):
+        """Describe the list item for XBMC for this PluginMovieItem.
+    The description is a plain dict so that it can be sent to another process (@see: pluginsupport.createListItem)
+    @return the list item description"""
+        if self.__listItemSpec:
+            return self.__listItemSpec
 
         # get the current mode from the plugin's invocation arguments
         args = pluginsupport.getArguments()
@@ -97,10 +205,11 @@ class PluginMovieItem:
         if not contentTypeOfCurrentList in ["tvshows", "movies", "episodes"]:
             metadata = self.getMetadataLabels()
         elif contentTypeOfCurrentList == 'episodes':
-            metadata = metadataFacade.get_episode_meta(args['name'], args['imdbid'], self.season, self.episode)
+            metadata = getEpisodeMeta(args['name'], args['imdbid'], self.season, self.episode)
         else:
             # get metadata for this item
-            metadata = metadataFacade.get_meta(self.getMetadataMediaType(contentTypeOfCurrentList), self.getLabel())
+            mediaType = self.getMetadataMediaType(contentTypeOfCurrentList)
+            metadata = getMeta(mediaType, self.getLabel())
 
         if 'cover_url' in metadata:
             thumb = metadata['cover_url']
@@ -110,20 +219,25 @@ class PluginMovieItem:
         if 'imdb_id' in metadata:
             self.imdbid = metadata['imdb_id']
 
-        self.__listItem = xbmcgui.ListItem(self.getLabel(), iconImage=thumb, thumbnailImage=thumb, path=self.getPath())
-        self.__listItem.setInfo(type="Video", infoLabels=metadata)
+        self.__listItemSpec = {'label': self.getLabel(), 'thumb': thumb, 'path': self.getPath(), 'info': metadata,
+                               'properties': {}, 'contextMenu': None}
 
         if 'backdrop_url' in metadata:
             fanart = metadata['backdrop_url']
-            self.__listItem.setProperty('fanart_image', fanart)
+            self.__listItemSpec['properties']['fanart_image'] = fanart
 
         if self.isPlayable():
-            self.__listItem.setProperty('IsPlayable', 'true')
+            self.__listItemSpec['properties']['IsPlayable'] = 'true'
 
-        contextMenu = self.buildContextMenu()
-        if contextMenu:
-            self.__listItem.addContextMenuItems(contextMenu)
+        self.__listItemSpec['contextMenu'] = self.buildContextMenu()
 
+        return self.__listItemSpec
+
+    def getListItem(self):
+        """Create a list item for XBMC for this PluginMovieItem
+    @return the list item for XBMC"""
+        if not self.__listItem:
+            self.__listItem = pluginsupport.createListItem(self.getListItemSpec())
         return self.__listItem
 
     def getTargetUrl(self, action=None, extra=None):
@@ -131,12 +245,12 @@ class PluginMovieItem:
     @param action: optional action to add to the url"""
 
         #
-        # this needs to be removed... ugly hack to force calling getListItem() before this is called
-        # as getListItem() will change the state of this object by setting the imdbid
+        # this needs to be removed... ugly hack to force calling getListItemSpec() before this is called
+        # as getListItemSpec() will change the state of this object by setting the imdbid
         # this should be refactored out...
         #
-        if not self.__listItem:
-            self.getListItem()
+        if not self.__listItemSpec:
+            self.getListItemSpec()
 
         extra = extra or self.extraArgs
         if self.mode:
@@ -148,6 +262,11 @@ class PluginMovieItem:
                     argsMap[key] = value
             if self.imdbid:
                 argsMap['imdbid'] = self.imdbid
+            if self.season and self.episode:
+                argsMap['season'] = self.season
+                argsMap['episode'] = self.episode
+                if self.show:
+                    argsMap['show'] = self.show
             return pluginsupport.encode(argsMap)
         return self.url
 
@@ -165,7 +284,7 @@ def mode(modeId, contentType=None, playable=False):
   @param playable: if the content is playable"""
 
     def decorate(function):
-        log.debug("registering mode %r with content %r" % (modeId, contentType))
+        log.debug("registering mode %r with content %r", modeId, contentType)
         modeHandlers[modeId] = HandlerWrapper(function, contentType, playable)
 
     return decorate
@@ -204,6 +323,7 @@ def __isAction(arguments):
 def initialize(addonId, implementationModule):
     import logging.config
     import os
+    import xbmc
     import xbmcaddon
     import importlib
 
@@ -211,6 +331,9 @@ def initialize(addonId, implementationModule):
     addon = xbmcaddon.Addon(addonId)
     addonPath = addon.getAddonInfo('path')
 
+    # where the addon keeps its caches
+    storage.initialize(xbmc.translatePath(addon.getAddonInfo('profile')))
+
     # configure logging
     configRoot = os.path.join(addonPath, "resources", "logging.conf")
     try:
@@ -218,9 +341,19 @@ def initialize(addonId, implementationModule):
     except:
         logging.basicConfig()
         logging.getLogger('root').exception('Failed to initialize logging... falling back to defaults.')
+    logs.configure()
+
+    # before any request, as the resident service's background work starts right away
+    _configureRequests()
 
     importlib.import_module(implementationModule)
 
+
+def _configureRequests():
+    """Configure the plugin's requests with the user's settings: the site's mirrors and request hedging"""
+    deadlines.setHedging(settings.isSet("hedge-requests"))
+    mirrors.setHosts(settings.get("mirrors").split(','))
+
 def handle():
     """
   Handle an XBMC plugin request.
@@ -228,6 +361,8 @@ def handle():
   then if they-re in normal flor, handle the result by either listing the items or playing them.
   """
     arguments = pluginsupport.getArguments()
+    # again, for the settings the user changed while the resident service runs
+    _configureRequests()
 
     def __getArgument(arg):
         if not arguments.has_key(arg):
@@ -238,21 +373,41 @@ def handle():
 
     if __isAction(arguments):
         action = __getArgument('action')
-        log.debug("invoking action '%s'" % action)
+        log.debug("invoking action '%s'", action)
         actionHandlers[action].call(arguments)
     else:
         mode = __getArgument('mode') or "ROOT"
         handler = modeHandlers[mode]
-        log.debug("invoking mode %r handler with arguments %r" % (mode, arguments))
+        log.debug("invoking mode %r handler with arguments %r", mode, arguments)
         result = handler.call(arguments)
-        log.debug("results from mode %r handler: %r" % (mode, result))
+        log.debug("results from mode %r handler: %r", mode, result)
         if handler.playable:
-            log.debug("playing results for mode %r" % mode)
+            log.debug("playing results for mode %r", mode)
             pluginsupport.play(result.items)
         else:
-            log.debug("listing results for mode %r" % mode)
+            log.debug("listing results for mode %r", mode)
             pluginsupport.list(result, handler.getContentType(arguments))
         pluginsupport.done()
+    if cache.isEvictionDue():
+        background.submit("eviction", cache.evictExpired)
+    deadlines.saveStats()
+
+
+def handleRecorded(argv):
+    """
+  Handle an XBMC plugin request recording its results instead of sending them to XBMC.
+  This is how the resident service handles the requests forwarded to it, each on a thread of its own
+  (@see: utils.service)
+  @param argv: the invocation arguments of the request
+  @return: the recorded calls to send to XBMC
+  """
+    recorder = pluginsupport.RecordingOutput()
+    previous = pluginsupport.setInvocation(argv, recorder)
+    try:
+        handle()
+    finally:
+        pluginsupport.setInvocation(*previous)
+    return recorder.calls
 
 
 class HandlerWrapper:
@@ -306,8 +461,8 @@ def _executeOne(f, params={}):
     fargs = inspect.getargspec(f)[0]
     if not fargs:
         return f()
-    log.debug("Function has args: %s" % str(fargs))
+    log.debug("Function has args: %s", fargs)
     args = __mapArgs(fargs, params)
-    log.debug("Dispatching call to function with args: %s" % str(args))
+    log.debug("Dispatching call to function with args: %s", args)
     return f(**args)
 
@@ -10,16 +10,16 @@ Created on Dec 5, 2010
 
 @author: pguedes
 '''
-import logging
 
-from plugin import PluginMovieItem, PluginResult, PluginContentType
+from plugin import PluginMovieItem, PluginResult, PluginContentType, StagedResult
 import utils.htmlutils as http
 import xbmc
-import urllib, re
-from utils import settings
+import threading, urllib, re, time
+from utils import settings, cache, background, logs, pipeline, pluginsupport, warming
+from utils.extraction import BlockExtractor, expect, skipTo, captureTo
 import plugin
 
-log = logging.getLogger("primewire")
+log = logs.getLogger("primewire")
 
 MODE_LIST_CATEGORY = 'category'
 MODE_PLAY_ITEM = 'play'
@@ -29,14 +29,40 @@ MODE_RSS = 'rss'
 
 SEARCH_SECTION_MOVIES = '1'
 SEARCH_SECTION_TV = '2'
-SEARCH_URL_TPL = 'http://www.primewire.ag/index.php?search_keywords=%s&search_section=%s&key=%s'
-
-CATEGORY_ITEM_PATTERN = '<div class="index_item index_item_ie"><a href="([^"]+?)" title="Watch ([^\(]+?) \((\d+)\)".+?img.+?src="([^"]+?)".+?</a>.+?</div></div>'
-EPISODE_ITEM_PATTERN = '<div class="tv_episode_item">.+?href="(.+?)">.+?> - (.+?)</span>.+?</div>'
-SOURCE_PATTERN = '/external.php\?(.+?)".+?<span class="version_host">(.+?)</span>'
+SEARCH_URL_TPL = '/index.php?search_keywords=%s&search_section=%s&key=%s'
+
+# (url, name, year, thumb) from: <div class="index_item index_item_ie"><a href="([^"]+?)" title="Watch ([^\(]+?) \((\d+)\)".+?img.+?src="([^"]+?)".+?</a>.+?</div></div>
+CATEGORY_ITEM_EXTRACTOR = BlockExtractor('<div class="index_item index_item_ie">',
+                                         [expect('<a href="'), captureTo('"', excluded='"'),
+                                          expect(' title="Watch '), captureTo(' (', excluded='('),
+                                          captureTo(')"', validate=str.isdigit),
+                                          skipTo('img'), skipTo('src="'), captureTo('"', excluded='"'),
+                                          skipTo('</a>'), skipTo('</div></div>')], singleLine=True)
+# (url, title) from: <div class="tv_episode_item">.+?href="(.+?)">.+?> - (.+?)</span>.+?</div>
+EPISODE_ITEM_EXTRACTOR = BlockExtractor('<div class="tv_episode_item">',
+                                        [skipTo('href="'), captureTo('">'), skipTo('> - '), captureTo('</span>'),
+                                         skipTo('</div>')])
+# (link, source) from: /external.php\?(.+?)".+?<span class="version_host">(.+?)</span>
+SOURCE_EXTRACTOR = BlockExtractor('/external.php?',
+                                  [captureTo('"'), skipTo('<span class="version_host">'), captureTo('</span>')])
+
+EPISODE_NUMBER_PATTERN = re.compile("season-(\d+)-episode-(\d+)")
+SOURCE_NAME_PATTERN = re.compile("document.writeln\(\'(.+?)\'\)", re.DOTALL)
+SOURCE_URL_PATTERN = re.compile(".+?&url=(.+?)&.+?")
+PAGE_NUMBER_PATTERN = re.compile("([?&])page=(\d+)")
 
 ALPHA_FILTER = "#"
 
+LISTING_CACHE_TIME = 60 * 60
+"""how long, in seconds, after a listing expires it is still shown while it is refreshed (@see: _parsePage)"""
+LISTING_STALE_TIME = cache.EXPIRED_KEEP_TIME
+SOURCES_CACHE_TIME = 60 * 60
+
+"""resolve the next episode's links when the episode being played is this close to its end (in seconds)"""
+PREFETCH_RESOLVE_BEFORE_END = 5 * 60
+PREFETCH_PLAYBACK_START_TIMEOUT = 60
+PREFETCH_POLL_INTERVAL = 10
+
 plugin.normalFlowActions.append("selectSource")
 
 
@@ -44,11 +70,15 @@ plugin.normalFlowActions.append("selectSource")
 def listCategories():
     """List the root categories for this plugin
     @return: a list of PluginMovieItems with the root categories"""
-    return PluginResult(4, [LWTPluginMovieItem("Tv", 'http://www.primewire.ag/?tv=&sort=featured', MODE_LIST_CATEGORY),
-                            LWTPluginMovieItem("Movies", 'http://www.primewire.ag/', MODE_LIST_CATEGORY),
-                            LWTPluginMovieItem("Search Movies", '', MODE_SEARCH),
-                            LWTPluginMovieItem("Search Tv Shows", '', MODE_SEARCH,
-                                               extraArgs={'search_section': SEARCH_SECTION_TV})])
+    items = _getRootItems()
+    return PluginResult(len(items), items)
+
+
+def _getRootItems():
+    return [LWTPluginMovieItem("Tv", '/?tv=&sort=featured', MODE_LIST_CATEGORY),
+            LWTPluginMovieItem("Movies", '/', MODE_LIST_CATEGORY),
+            LWTPluginMovieItem("Search Movies", '', MODE_SEARCH),
+            LWTPluginMovieItem("Search Tv Shows", '', MODE_SEARCH, extraArgs={'search_section': SEARCH_SECTION_TV})]
 
 
 def __categoryContentType(params):
@@ -74,12 +104,12 @@ def _listLetters(url, name):
 
 @plugin.mode(MODE_LIST_CATEGORY, __categoryContentType)
 def listCategory(url, name, letter=None):
-    log.debug("calling list categories %r" % name)
+    log.debug("calling list categories %r", name)
     if settings.isSet("group-categories-by-letter") and not letter:
-        log.debug("listing all letter filters for category %r" % name)
+        log.debug("listing all letter filters for category %r", name)
         return _listLetters(url, name)
         # delegate to listCategoryLetter with no filter, to list all
-    log.debug("listing with no letter filter for category %r" % name)
+    log.debug("listing with no letter filter for category %r", name)
     return _listCategory(url, name, letter)
 
 
@@ -104,41 +134,184 @@ def _listCategory(url, name, letter=None):
             return True
         return letter == name[0]
 
-    log.debug("requesting url %r for category %r" % (url, name))
-    page = http.get(url, cleanup=True)
-    #log.debug(page)
-    match = re.compile(CATEGORY_ITEM_PATTERN).findall(page)
-    #log.debug("Results: %s"%str(match))
-    if letter:
-        match = [item for item in match if _shouldInclude(item[1])]
-    size = len(match)
-
-    def itemGenerator():
-        for itemUrl, name, year, thumb in match:
+    stale = []
+
+    # pages are loaded at the same time, and each one's results are kept here as (results, error)
+    loaded = {}
+    loadedCondition = threading.Condition()
+
+    def _loadPage(pageUrl):
+        try:
+            page = _parsePage(pageUrl, 'category', CATEGORY_ITEM_EXTRACTOR, stale=stale) or [], None
+        except Exception as e:
+            log.exception("Failed to load page %r for category %r", pageUrl, name)
+            page = None, e
+        loadedCondition.acquire()
+        try:
+            loaded[pageUrl] = page
+            loadedCondition.notifyAll()
+        finally:
+            loadedCondition.release()
+        return pageUrl
+
+    def _extractItems(pageUrl):
+        # items can move to the next page while we load, so an item is only listed on the first page it is on, and
+        # the listing ends at the first page that failed to load: the pages before this one are needed
+        earlierUrls = pageUrls[:pageUrls.index(pageUrl)]
+        loadedCondition.acquire()
+        try:
+            while [earlierUrl for earlierUrl in earlierUrls if earlierUrl not in loaded]:
+                loadedCondition.wait()
+            earlier = [loaded[earlierUrl] for earlierUrl in earlierUrls]
+            results, error = loaded[pageUrl]
+        finally:
+            loadedCondition.release()
+
+        if [earlierError for earlierResults, earlierError in earlier if earlierError is not None]:
+            return []
+        if error is not None:
+            if not earlierUrls:
+                raise error
+            # the "more..." item goes on from the page that failed
+            return [LWTPluginMovieItem("more...", pageUrl, MODE_LIST_CATEGORY)]
+        seen = set([item[0] for earlierResults, earlierError in earlier for item in earlierResults])
+        items = []
+        for itemUrl, name, year, thumb in results:
+            if itemUrl in seen or not _shouldInclude(name):
+                continue
+            seen.add(itemUrl)
             mode = _getMode(url)
-            log.debug("creating item: title: '%s' URL: '%s' mode:'%s'" % (str(name), str(itemUrl), str(mode)))
-            yield LWTPluginMovieItem(name, itemUrl, mode)
-        nextpageurl = __getNextPageUrl(url)
-        log.debug("next page: '%s'" % str(nextpageurl))
-        yield LWTPluginMovieItem("more...", nextpageurl, MODE_LIST_CATEGORY)
-
-    log.debug("found result of size %r" % name)
-    return PluginResult(size, itemGenerator)
-
-
-def __url(url):
-    return "http://www.primewire.ag" + url
+            log.debug("creating item: title: '%s' URL: '%s' mode:'%s'", name, itemUrl, mode)
+            items.append(LWTPluginMovieItem(name, itemUrl, mode))
+        if pageUrl == pageUrls[-1]:
+            nextpageurl = __getNextPageUrl(pageUrl)
+            log.debug("next page: '%s'", nextpageurl)
+            items.append(LWTPluginMovieItem("more...", nextpageurl, MODE_LIST_CATEGORY))
+        return items
+
+    # load as many consecutive pages as the user wants in one listing, at the same time, and list their items
+    # while the next ones load
+    pageUrls = _getListingPageUrls(url)
+    log.debug("requesting urls %r for category %r", pageUrls, name)
+    stages = [pipeline.Stage("fetch", _loadPage, len(pageUrls)),
+              pipeline.Stage("extract", _extractItems, len(pageUrls), expand=True)]
+    return StagedResult(0, pageUrls, stages, lambda: _refreshInBackground(stale))
+
+
+def _getListingPageUrls(url):
+    """Get the urls of the pages of a category shown in one listing
+    @param url: the url of the listing's first page
+    @return: the list of urls of the pages"""
+    pageUrls = [url]
+    for page in range(1, _getPagesPerListing()):
+        nextPageUrl = __getNextPageUrl(pageUrls[-1])
+        if nextPageUrl in pageUrls:
+            break
+        pageUrls.append(nextPageUrl)
+    return pageUrls
+
+
+def _getPagesPerListing():
+    """Get how many pages of a category the user wants to see in one listing
+    @return: the number of pages per listing"""
+    try:
+        return max(1, int(settings.get("pages-per-listing")))
+    except ValueError:
+        return 1
+
+
+def _parsePage(url, kind, extractor, transform=None, stale=None):
+    """Load a listing page and parse it.
+    Pages are revalidated with the server once they expire from the page cache, and while a page does not
+    change the results parsed from it are reused instead of parsing it again.
+    In low memory mode the page is streamed through the cache and parsed in chunks, instead of as a whole.
+
+    Listings can be shown stale while they are revalidated: if a stale list is given and the page expired
+    (less than LISTING_STALE_TIME ago) the results parsed from the expired page are returned right away, and
+    the page is added to the stale list to be refreshed in the background (@see: _refreshInBackground).
+    @param url: the url of the page
+    @param kind: the kind of results parsed from the page
+    @param extractor: the BlockExtractor for the results on the page
+    @param transform: an optional function to transform each extracted result with
+    @param stale: a list to collect the pages whose stale results were returned, None to always revalidate
+    @return: the list of results parsed from the page"""
+    lowMemory = settings.isSet("low-memory-mode")
+    if stale is not None:
+        results = _getStaleResults(url, kind)
+        if results is not None:
+            log.debug("showing stale %s of %s while it is refreshed", kind, url)
+            stale.append((url, kind, extractor, transform, lowMemory, results))
+            return results
+    return _loadParsedPage(url, kind, extractor, transform, lowMemory)
+
+
+def _loadParsedPage(url, kind, extractor, transform, lowMemory):
+    page = http.getPage(url, LISTING_CACHE_TIME, cleanup=True, stream=lowMemory)
+
+    def parse():
+        if lowMemory:
+            results = extractor.iterfind(page.chunks())
+        else:
+            results = extractor.findall(page.html)
+        if transform:
+            return [transform(result) for result in results]
+        return list(results)
+
+    return cache.parsed.getVersioned(_getParsedKey(url, kind), page.version, parse)
+
+
+def _getParsedKey(url, kind):
+    return "%s:%s" % (kind, http.getCacheKey(url))
+
+
+def _getStaleResults(url, kind):
+    """Get the results parsed from an expired page, if it did not expire long ago
+    @return: the results parsed from the cached page, or None if the page is fresh, too old, or not cached"""
+    meta = cache.pages.getMeta(http.getCacheKey(url))
+    if not meta or cache.isFresh(meta) or meta['expires'] + LISTING_STALE_TIME < time.time():
+        return None
+    parsedMeta = cache.parsed.getMeta(_getParsedKey(url, kind))
+    if not parsedMeta or parsedMeta.get('version') != meta.get('version'):
+        return None
+    return cache.parsed.getValue(_getParsedKey(url, kind))
+
+
+def _refreshInBackground(stale):
+    """Refresh the stale pages of a listing in the background (@see: _refreshListing)
+    @param stale: the pages collected by _parsePage"""
+    if stale:
+        background.submit("refresh", _refreshListing, stale, pluginsupport.getInvocationUrl(),
+                          settings.isSet("autoreload-metadata-update"))
+
+
+def _refreshListing(cancelled, stale, folderPath, reload):
+    """Revalidate the stale pages of a listing, and reload the listing if their results changed while the user is
+    still looking at it
+    @param cancelled: the event set when this task is cancelled
+    @param stale: the pages collected by _parsePage
+    @param folderPath: the plugin url of the listing
+    @param reload: if the listing should be reloaded when it changes"""
+    changed = False
+    for url, kind, extractor, transform, lowMemory, results in stale:
+        if cancelled.isSet():
+            return
+        try:
+            changed = _loadParsedPage(url, kind, extractor, transform, lowMemory) != results or changed
+        except:
+            log.exception("Failed to refresh %s of %s", kind, url)
+    log.debug("refreshed listing %s (changed: %s)", folderPath, changed)
+    if changed and reload and not cancelled.isSet() and xbmc.getInfoLabel("Container.FolderPath") == folderPath:
+        xbmc.executebuiltin("Container.Refresh")
 
 
 def __getNextPageUrl(url):
-    pageregex = re.compile("=&page=(.+)")
-    currentpage = pageregex.findall(url)
-    if len(currentpage) > 0:
-        currentpagenum = int(currentpage[0])
-        return pageregex.sub("=&page=%d" % (currentpagenum + 1), url)
+    currentpage = PAGE_NUMBER_PATTERN.search(url)
+    if currentpage:
+        currentpagenum = int(currentpage.group(2))
+        return PAGE_NUMBER_PATTERN.sub(r"\1page=%d" % (currentpagenum + 1), url, 1)
     if url.find("?tv") > 0:
-        return __url("/index.php?tv=&page=2")
-    return __url("/index.php?page=2")
+        return "/index.php?tv=&page=2"
+    return "/index.php?page=2"
 
 
 @plugin.mode(MODE_LIST_EPISODES, contentType=PluginContentType.EPISODES)
@@ -147,22 +320,68 @@ def listEpisodes(url, name):
     @param url: the tvshack url to load episodes from
     @param label: the tvshow being listed
     @return: a list of LWTPluginMovieItem with the episode items"""
-    url = __url(url)
-    html = http.get(url, cleanup=True)
-
-    episodeLinks = re.compile(EPISODE_ITEM_PATTERN, re.DOTALL).findall(html)
-    itemCount = len(episodeLinks)
-
-    def itemGen():
-        for episodeurl, episodetitle in episodeLinks:
-            season, episode = re.compile("season-(.+?)-episode-(.+?)").findall(episodeurl)[0]
-            yield LWTPluginMovieItem(episodetitle, episodeurl, MODE_PLAY_ITEM, season=season, episode=episode)
-
-    return PluginResult(itemCount, itemGen)
+    warming.rememberVisit(url, name)
+    stale = []
+
+    def _loadEpisodes(url):
+        return _parsePage(url, 'episodes', EPISODE_ITEM_EXTRACTOR, _numberEpisode, stale)
+
+    def _extractItems(episodeLinks):
+        return [LWTPluginMovieItem(episodetitle, episodeurl, MODE_PLAY_ITEM, season=season, episode=episode,
+                                   show=url) for episodeurl, episodetitle, season, episode in episodeLinks]
+
+    stages = [pipeline.Stage("fetch", _loadEpisodes),
+              pipeline.Stage("extract", _extractItems, expand=True)]
+    return StagedResult(0, [url], stages, lambda: _refreshInBackground(stale))
+
+
+def warmCaches(cancelled, budget):
+    """Warm the caches for the listings the user opens every day: the root categories and the recently visited
+    shows, with the metadata of their items (@see: utils.warming)
+    @param cancelled: the event set when warming is cancelled
+    @param budget: the Budget to warm the caches within"""
+    def shouldStop():
+        return cancelled.isSet() or budget.isSpent()
+
+    for category in _getRootItems():
+        if category.mode != MODE_LIST_CATEGORY:
+            continue
+        mediaType = category.url.find('?tv') >= 0 and 'tvshow' or 'movie'
+        for pageUrl in _getListingPageUrls(category.url):
+            if shouldStop():
+                return
+            for itemUrl, name, year, thumb in _parsePage(pageUrl, 'category', CATEGORY_ITEM_EXTRACTOR):
+                if shouldStop():
+                    return
+                budget.charge()
+                plugin.getMeta(mediaType, name)
+
+    for showUrl, showName in warming.getVisited():
+        if shouldStop():
+            return
+        episodes = _parsePage(showUrl, 'episodes', EPISODE_ITEM_EXTRACTOR, _numberEpisode)
+        budget.charge()
+        imdbid = plugin.getMeta('tvshow', showName).get('imdb_id')
+        if not imdbid:
+            continue
+        for episodeUrl, title, season, episode in episodes:
+            if shouldStop():
+                return
+            budget.charge()
+            plugin.getEpisodeMeta(showName, imdbid, season, episode)
+
+
+def _numberEpisode(item):
+    """Add the season and episode numbers to an episode extracted from a show's page
+    @param item: the (url, title) of the episode
+    @return: the (url, title, season, episode) of the episode"""
+    episodeurl, episodetitle = item
+    season, episode = EPISODE_NUMBER_PATTERN.findall(episodeurl)[0]
+    return episodeurl, episodetitle, season, episode
 
 
 def getSourceName(sourceClob):
-    name = re.compile("document.writeln\(\'(.+?)\'\)", re.DOTALL).findall(sourceClob)
+    name = SOURCE_NAME_PATTERN.findall(sourceClob)
     if name:
         return name[0]
 
@@ -172,8 +391,45 @@ def getSourceName(sourceClob):
         return 'sockshare'
 
 
+def _loadSourceLinks(url):
+    """Load the links to the hosters (sources) of a movie/episode
+    The links parsed from a page are cached, so resolving the same item again (ie: to select another source)
+    needs neither loading nor parsing its page. Once they expire, the page is revalidated and the links are
+    only parsed again if it changed.
+    @param url: the url of the movie/episode
+    @return: a list of (url, sourceName) tuples with the links to the hosters"""
+    key = http.getCacheKey(url)
+    meta = cache.sources.getMeta(key)
+    if cache.isFresh(meta):
+        outsideLinks = cache.sources.getValue(key)
+        if outsideLinks is not None:
+            log.debug("reusing links for %s", url)
+            return outsideLinks
+
+    page = http.getPage(url, SOURCES_CACHE_TIME, cleanup=True)
+    return cache.sources.getVersioned(key, page.version, lambda: _parseSourceLinks(page.html),
+                                      SOURCES_CACHE_TIME)
+
+
+def _parseSourceLinks(html):
+    """Parse the links to the hosters (sources) of a movie/episode from its page
+    @param html: the page of the movie/episode
+    @return: a list of (url, sourceName) tuples with the links to the hosters"""
+    alternateLinks = [(itemUrl, getSourceName(itemSource)) for (itemUrl, itemSource) in
+                      SOURCE_EXTRACTOR.findall(html)]
+
+    # The url on the page is to another primewire page, the actual external url is in a parameter of the url
+    outsideLinks = []
+    for link, name in alternateLinks:
+        match = SOURCE_URL_PATTERN.findall(link)[0]
+        outsideLinks.append((match.decode('base-64'), name))
+
+    log.debug("found links in page: %s", outsideLinks)
+    return outsideLinks
+
+
 @plugin.mode(MODE_PLAY_ITEM, playable=True)
-def resolveFiles(url, name, forceSourceSelection=False):
+def resolveFiles(url, name, season=None, episode=None, show=None, forceSourceSelection=False):
     """Resolve the files for a movie/episode/... item
 
     Resolving a file is split into three phases:
@@ -186,27 +442,20 @@ def resolveFiles(url, name, forceSourceSelection=False):
     setting is enabled, the first available source that matches the 'preferred-source' setting
     will be auto-selected.
 
+    When playing an episode, the next episode is prepared in the background (@see: _prefetchNextEpisode).
+
     @param url: the url to resolve files for
-    @param label: the label of the playable item being resolved
+    @param name: the label of the playable item being resolved
+    @param season: the season of the episode being resolved (for episodes)
+    @param episode: the number of the episode being resolved (for episodes)
+    @param show: the url of the listing of the show's episodes (for episodes)
     @param forceSourceSelection: if the user should be forced to select the source (default False)
     @return: a list of urls of the files to play"""
-    log.debug("Listing sources: %s, forceSelection: %s" % (url, forceSourceSelection))
-    html = http.get(__url(url), cleanup=True)
-
-    alternateLinks = [(itemUrl, getSourceName(itemSource)) for (itemUrl, itemSource) in
-                      re.compile(SOURCE_PATTERN, re.DOTALL).findall(html)]
-
-    # The url on the page is to another primewire page, the actual external url is in a parameter of the url
-    outsideLinks = []
-    for link, name in alternateLinks:
-        match = re.compile(".+?&url=(.+?)&.+?").findall(link)[0]
-        outsideLinks.append((match.decode('base-64'), name))
-
-    log.debug("found links in page: %s" % str(outsideLinks))
+    log.debug("Listing sources: %s, forceSelection: %s", url, forceSourceSelection)
+    outsideLinks = _loadSourceLinks(url)
     from utils.sources import SourceList
 
-    sources = SourceList([(url, name) for url, name in outsideLinks],
-                         settings.isSet("filter-unsupported-sources"))
+    sources = SourceList(outsideLinks, settings.isSet("filter-unsupported-sources"))
 
     autoSelectSource = None
     if settings.isSet("autoplay-preferred-source"):
@@ -215,10 +464,79 @@ def resolveFiles(url, name, forceSourceSelection=False):
     selected = sources.selectSource(forceSourceSelection, autoSelectSource)
     if selected:
         link = selected.resolve()
-        log.debug("resolved link for video: %s" % str(link))
+        log.debug("resolved link for video: %s", link)
+        if show and season and episode:
+            background.submitShared("prefetch", _prefetchNextEpisode, show, season, episode,
+                                    selected.getHosterName(), link)
         return PluginResult(1, [LWTPluginMovieItem(name, link)])
 
 
+def _prefetchNextEpisode(cancelled, showUrl, season, episode, sourceName, link):
+    """Prepare the next episode of a show while the current one plays.
+    The next episode is found on the show's listing (cached when the episode was listed), and its page is loaded
+    and its links parsed right away, then, in the resident service, its link on the hoster being used is resolved
+    when the current episode nears its end, so that playing it starts right away (a plugin process does not wait
+    for the episode to end, @see: background.isResident).
+    Runs in the background and stops if cancelled (ie: when another episode is played, by any plugin process) or
+    if the current episode stops playing.
+    @param cancelled: the event set when this task is cancelled
+    @param showUrl: the url of the listing of the show's episodes
+    @param season: the season of the episode being played
+    @param episode: the number of the episode being played
+    @param sourceName: the name of the hoster the episode is being played from
+    @param link: the resolved link of the episode being played"""
+    current = (int(season), int(episode))
+    following = [((int(s), int(e)), episodeUrl) for episodeUrl, title, s, e in
+                 _parsePage(showUrl, 'episodes', EPISODE_ITEM_EXTRACTOR, _numberEpisode)
+                 if (int(s), int(e)) > current]
+    if not following or cancelled.isSet():
+        return
+    nextNumber, nextUrl = min(following)
+    log.debug("prefetching episode %r after %r: %s", nextNumber, current, nextUrl)
+    urls = [link for link, name in _loadSourceLinks(nextUrl) if name == sourceName]
+
+    if urls and background.isResident() and _waitForEndOfPlayback(cancelled, link):
+        from utils.sources import Source
+
+        log.debug("resolving links for next episode %s on %s", nextUrl, sourceName)
+        Source(urls, sourceName).resolve(notify=False)
+
+
+def _waitForEndOfPlayback(cancelled, link):
+    """Wait until a video being played nears its end
+    @param cancelled: the event set when the waiting task is cancelled
+    @param link: the link of the video
+    @return: true if the video is near its end, false if it stopped playing (or another video is playing) or the
+        task was cancelled"""
+    player = xbmc.Player()
+    # playback only starts after the plugin answers XBMC
+    waited = 0
+    while not _isPlaying(player, link):
+        if waited >= PREFETCH_PLAYBACK_START_TIMEOUT or background.sleep(cancelled, 1):
+            return False
+        waited += 1
+
+    while _isPlaying(player, link):
+        try:
+            if player.getTotalTime() - player.getTime() <= PREFETCH_RESOLVE_BEFORE_END:
+                return True
+        except RuntimeError:
+            # playback ended between the checks
+            return False
+        if background.sleep(cancelled, PREFETCH_POLL_INTERVAL):
+            return False
+    return False
+
+
+def _isPlaying(player, link):
+    """check if the player is playing a link (links can have protocol parameters for the player after a '|')"""
+    try:
+        return player.isPlayingVideo() and player.getPlayingFile().split('|')[0] == link.split('|')[0]
+    except RuntimeError:
+        # playback ended between the checks
+        return False
+
+
 def __searchContentType(params):
     """
     Get the content type for some search results
@@ -235,16 +553,16 @@ def search(search_section=SEARCH_SECTION_MOVIES):
     keyb = xbmc.Keyboard('', 'Search primewire.ag')
     keyb.doModal()
     if keyb.isConfirmed():
-        html = http.get("")
+        html = http.get("/")
         searchKey = re.search('input type="hidden" name="key" value="([0-9a-f]*)"', html).group(1)
         search = keyb.getText()
         encode = urllib.quote(search).replace(' ', '+')
         html = http.get(SEARCH_URL_TPL % (encode, str(search_section), searchKey), cleanup=True)
-        match = re.compile(CATEGORY_ITEM_PATTERN).findall(html)
+        match = CATEGORY_ITEM_EXTRACTOR.findall(html)
 
         def itemGen():
             for itemUrl, name, year, thumb in match:
-                log.debug("found item: title: '%s' URL: '%s'" % (str(name), str(itemUrl)))
+                log.debug("found item: title: '%s' URL: '%s'", name, itemUrl)
                 resultsmode = MODE_PLAY_ITEM
                 if search_section == SEARCH_SECTION_TV:
                     resultsmode = MODE_LIST_EPISODES
@@ -257,12 +575,12 @@ def search(search_section=SEARCH_SECTION_MOVIES):
 class LWTPluginMovieItem(PluginMovieItem):
     """PluginMovieItem for primewire.ag"""
 
-    def __init__(self, name, url, mode=None, tags="", extraArgs=None, season=None, episode=None):
+    def __init__(self, name, url, mode=None, tags="", extraArgs=None, season=None, episode=None, show=None):
         """Create an item 
         @param label: the label for this item
         @param url: the url to load this item
         @param tags: the tags to show """
-        PluginMovieItem.__init__(self, name, url, mode, extraArgs, season, episode)
+        PluginMovieItem.__init__(self, name, url, mode, extraArgs, season, episode, show)
         self.title = name + tags
 
     def getTitle(self):
@@ -0,0 +1,35 @@
+# -*- coding: UTF-8 -*-
+import plugin
+import logging
+import xbmc
+import xbmcaddon
+from utils import background, deadlines, service
+
+ADDON_ID = 'plugin.video.primewire'
+
+plugin.initialize(ADDON_ID, 'primewire')
+background.setResident(True)
+
+log = logging.getLogger("root")
+
+
+def shouldStop():
+    return xbmc.abortRequested or xbmcaddon.Addon(ADDON_ID).getSetting("background-service") != "true"
+
+
+if xbmcaddon.Addon(ADDON_ID).getSetting("warm-caches") == "true":
+    import primewire
+    from utils import warming
+
+    background.submit("warming", warming.schedule, primewire.warmCaches)
+
+if service.isSupported() and not shouldStop():
+    try:
+        service.Server(service.getSocketPath(ADDON_ID), plugin.handleRecorded).serve(shouldStop)
+    except:
+        log.exception("Failed to run the plugin service")
+
+# keep warming the caches (if enabled) until XBMC shuts down
+background.wait()
+deadlines.saveStats()
+
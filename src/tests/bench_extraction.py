@@ -0,0 +1,53 @@
+# -*- coding: UTF-8 -*-
+'''
+Microbenchmark of the extractors of the items of primewire's pages against the regular expressions they replaced,
+on the pages saved in the fixtures folder and on pages of unterminated blocks (the worst case of the regexes).
+Run it with the python XBMC uses:
+
+    python tests/bench_extraction.py
+
+Created on Oct 19, 2026
+
+@author: pguedes
+'''
+import os, sys, time
+
+if __package__ is None:
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tests import kodi
+kodi.install()
+import primewire
+from tests import test_primewire
+
+"""how many times each page is parsed"""
+REPEAT = 200
+"""the numbers of unterminated blocks of the worst case pages"""
+WORST_CASE_BLOCKS = (10, 25, 50)
+
+
+def timeit(function, html, repeat):
+    '''get the average time, in milliseconds, a function takes to parse a page'''
+    started = time.time()
+    for attempt in range(repeat):
+        function(html)
+    return (time.time() - started) * 1000 / repeat
+
+
+def main():
+    print("%-32s %12s %12s" % ("page", "regex", "extractor"))
+    for name, pattern, extractor in (
+            ("category.html", test_primewire.CATEGORY_ITEM_PATTERN, primewire.CATEGORY_ITEM_EXTRACTOR),
+            ("episodes.html", test_primewire.EPISODE_ITEM_PATTERN, primewire.EPISODE_ITEM_EXTRACTOR),
+            ("sources.html", test_primewire.SOURCE_PATTERN, primewire.SOURCE_EXTRACTOR)):
+        html = test_primewire.loadFixture(name)
+        print("%-32s %10.3fms %10.3fms" % (name, timeit(pattern.findall, html, REPEAT),
+                                           timeit(extractor.findall, html, REPEAT)))
+    for blocks in WORST_CASE_BLOCKS:
+        html = test_primewire.UNTERMINATED_EPISODE * blocks
+        print("%-32s %10.3fms %10.3fms" % ("%d unterminated episodes" % blocks,
+                                           timeit(test_primewire.EPISODE_ITEM_PATTERN.findall, html, 1),
+                                           timeit(primewire.EPISODE_ITEM_EXTRACTOR.findall, html, REPEAT)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+# -*- coding: UTF-8 -*-
+'''
+Microbenchmark of a debug message logged for every item of a listing, with DEBUG disabled (like XBMC runs the
+plugin, @see: resources/logging.conf): formatted with the % operator, given with its arguments to a logger of the
+logging module, and given with its arguments to a logger of the plugin (@see: utils.logs.getLogger).
+Run it with the python XBMC uses:
+
+    python tests/bench_logs.py [items]
+
+Created on Oct 19, 2026
+
+@author: pguedes
+'''
+import logging, os, sys, time
+
+if __package__ is None:
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tests import kodi
+kodi.install()
+from utils import logs
+
+"""the arguments of the message logged for each item"""
+NAME = u"Some Show Name (2010)"
+URL = "/watch-1234-Some-Show-Name"
+MODE = "episodes"
+
+
+def timeit(function, items):
+    '''get the average time, in microseconds, a function takes to log the message of an item'''
+    started = time.time()
+    for item in range(items):
+        function()
+    return (time.time() - started) * 1000000 / items
+
+
+def main(items):
+    logging.basicConfig(level=logging.WARNING)
+    standard = logging.getLogger("bench")
+    lazy = logs.getLogger("bench")
+    logs.configure()
+    print("%d items" % items)
+    for label, function in (
+            ("formatted", lambda: standard.debug("creating item: title: '%s' URL: '%s' mode:'%s'" %
+                                                 (NAME, URL, MODE))),
+            ("logging arguments", lambda: standard.debug("creating item: title: '%s' URL: '%s' mode:'%s'",
+                                                         NAME, URL, MODE)),
+            ("logs arguments", lambda: lazy.debug("creating item: title: '%s' URL: '%s' mode:'%s'",
+                                                  NAME, URL, MODE))):
+        print("%-20s %8.3fus" % (label, timeit(function, items)))
+
+
+if __name__ == '__main__':
+    main(len(sys.argv) > 1 and int(sys.argv[1]) or 200000)
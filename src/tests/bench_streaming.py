@@ -0,0 +1,88 @@
+# -*- coding: UTF-8 -*-
+'''
+Benchmark of the peak memory used to parse a big listing page, whole (like the plugin does by default) and
+streamed in chunks (like it does in low memory mode, @see: htmlutils.cleanChunks, BlockExtractor.iterfind).
+
+Each mode runs in its own process, which reports how much its peak resident memory grew while parsing.
+Run it with the python XBMC uses:
+
+    python tests/bench_streaming.py [megabytes of page]
+
+Created on Oct 19, 2026
+
+@author: pguedes
+'''
+import os, resource, subprocess, sys, tempfile, time
+
+if __package__ is None:
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tests import kodi
+
+"""the modes to parse the page with"""
+MODES = ('whole', 'streamed')
+
+ITEM = ('<div class="index_item index_item_ie"><a href="/watch-%d-Movie-%d" title="Watch Movie &amp; %d (%d)">'
+        '<img src="http://images.example.com/%d.jpg" border="0"></a><div class="index_ratings">'
+        '&nbsp;<font class="rating">4</font></div></div></div>\n')
+
+
+def writePage(path, megabytes):
+    '''write a listing page of about some megabytes'''
+    output = open(path, 'wb')
+    try:
+        output.write('<html><body>\n')
+        written = number = 0
+        while written < megabytes * 1024 * 1024:
+            item = ITEM % (number, number, number, 1950 + number % 70, number)
+            output.write(item)
+            written += len(item)
+            number += 1
+        output.write('</body></html>\n')
+    finally:
+        output.close()
+
+
+def _peakKilobytes():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def parse(path, mode):
+    '''parse a page in a mode, and print how many items were found, how long it took and the peak memory grew'''
+    kodi.install()
+    import primewire
+    from utils import htmlutils
+    extractor = primewire.CATEGORY_ITEM_EXTRACTOR
+    before = _peakKilobytes()
+    started = time.time()
+    input = open(path, 'rb')
+    try:
+        if mode == 'whole':
+            items = len(extractor.findall(htmlutils.cleanHtml(input.read())))
+        else:
+            chunks = iter(lambda: input.read(htmlutils.CHUNK_SIZE), '')
+            items = 0
+            for fields in extractor.iterfind(htmlutils.cleanChunks(chunks)):
+                items += 1
+    finally:
+        input.close()
+    print("%d %.3f %d" % (items, time.time() - started, _peakKilobytes() - before))
+
+
+def main(megabytes):
+    path = os.path.join(tempfile.gettempdir(), "bench-streaming.html")
+    writePage(path, megabytes)
+    try:
+        print("page of %.1fMB" % (os.path.getsize(path) / 1024.0 / 1024))
+        for mode in MODES:
+            output = subprocess.check_output([sys.executable, os.path.abspath(__file__), mode, path])
+            items, elapsed, peak = output.split()
+            print("%-8s %s items in %ss, peak memory grew %.1fMB" % (mode, items, elapsed, int(peak) / 1024.0))
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] in MODES:
+        parse(sys.argv[2], sys.argv[1])
+    else:
+        main(len(sys.argv) > 1 and int(sys.argv[1]) or 20)
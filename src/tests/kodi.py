@@ -0,0 +1,67 @@
+# -*- coding: UTF-8 -*-
+'''
+Stand-ins for the modules XBMC provides to plugins, so that the plugin's modules can be imported outside of it
+by the tests and benchmarks. They do just enough to import the modules and parse pages, nothing is shown.
+
+Created on Oct 19, 2026
+
+@author: pguedes
+'''
+import os, sys, tempfile, types
+
+"""the folder the plugin's modules are imported from"""
+PLUGIN_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class _Any(object):
+    '''an object that accepts any call, and returns itself for any attribute'''
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __call__(self, *args, **kwargs):
+        return self
+
+    def __getattr__(self, name):
+        return self
+
+
+"""the profile folder of the plugin"""
+PROFILE_PATH = os.path.join(tempfile.gettempdir(), "primewire-tests")
+
+
+class _Addon(object):
+
+    def __init__(self, id=None):
+        pass
+
+    def getAddonInfo(self, key):
+        return {'path': PLUGIN_PATH, 'profile': PROFILE_PATH, 'id': 'plugin.video.primewire',
+                'version': '0.0'}.get(key, '')
+
+    def getSetting(self, key):
+        return ''
+
+
+def _module(name, **attributes):
+    module = types.ModuleType(name)
+    module.__dict__.update(attributes)
+    return module
+
+
+def install():
+    '''make the plugin importable: put its folder on the path, and stand-ins for the XBMC modules in sys.modules'''
+    if PLUGIN_PATH not in sys.path:
+        sys.path.insert(0, PLUGIN_PATH)
+    if 'xbmc' in sys.modules:
+        return
+    sys.modules['xbmc'] = _module('xbmc', PLAYLIST_VIDEO=1, abortRequested=False, Player=_Any, PlayList=_Any,
+                                  Monitor=_Any, Keyboard=_Any, translatePath=lambda path: path,
+                                  executebuiltin=lambda command: None, sleep=lambda milliseconds: None,
+                                  getInfoLabel=lambda label: '', getGlobalIdleTime=lambda: 0,
+                                  getCacheThumbName=lambda url: '')
+    sys.modules['xbmcplugin'] = _module('xbmcplugin', getSetting=lambda handle, key: '')
+    sys.modules['xbmcgui'] = _module('xbmcgui', ListItem=_Any, Dialog=_Any, DialogProgress=_Any)
+    sys.modules['xbmcaddon'] = _module('xbmcaddon', Addon=_Addon)
+    sys.modules['metahandler'] = _module('metahandler')
+    sys.modules['metahandler.metahandlers'] = _module('metahandler.metahandlers', MetaData=_Any)
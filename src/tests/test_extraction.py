@@ -0,0 +1,73 @@
+# -*- coding: UTF-8 -*-
+'''
+Tests of the block extractors: extracting from a page read in chunks of any size must give the same results
+as extracting from the whole page.
+
+Created on Oct 19, 2026
+
+@author: pguedes
+'''
+import unittest
+from utils.extraction import BlockExtractor, expect, captureTo
+
+MARKER = '<li class="item">'
+
+PAGE = ('<html><ul>'
+        '<li class="item"><a href="/first">First</a></li>\n'
+        '<li class="item"><a href="/second">Second\nline</a></li>\n'
+        '<li class="item"><a href="/malformed">Malformed</li>\n'
+        '<li class="item"><a href="/third">Third</a></li>'
+        '<li class="item"><a href="/last">Last</a></li></ul></html>')
+
+
+def _extractor(singleLine=False):
+    return BlockExtractor(MARKER, [expect('<a href="'), captureTo('"'), expect('>'), captureTo('</a>')],
+                          singleLine)
+
+
+def _chunks(html, size):
+    return [html[start:start + size] for start in range(0, len(html), size)]
+
+
+class IterfindTest(unittest.TestCase):
+
+    def testFindall(self):
+        self.assertEqual([('/first', 'First'), ('/second', 'Second\nline'), ('/third', 'Third'), ('/last', 'Last')],
+                         _extractor().findall(PAGE))
+        self.assertEqual([('/first', 'First'), ('/third', 'Third'), ('/last', 'Last')],
+                         _extractor(singleLine=True).findall(PAGE))
+
+    def testSameResultsForAnyChunkSize(self):
+        for singleLine in (False, True):
+            extractor = _extractor(singleLine)
+            expected = extractor.findall(PAGE)
+            for size in range(1, len(PAGE) + 1):
+                self.assertEqual(expected, list(extractor.iterfind(_chunks(PAGE, size))),
+                                 "chunks of %d (singleLine=%s)" % (size, singleLine))
+
+    def testMarkerSplitAcrossSmallChunks(self):
+        # the page starts with a marker split in chunks shorter than it
+        html = PAGE[PAGE.index(MARKER):]
+        extractor = _extractor()
+        for size in range(1, len(MARKER)):
+            self.assertEqual(extractor.findall(html), list(extractor.iterfind(_chunks(html, size))),
+                             "chunks of %d" % size)
+
+    def testEmptyChunks(self):
+        extractor = _extractor()
+        chunks = []
+        for chunk in _chunks(PAGE, 7):
+            chunks.extend(["", chunk, ""])
+        self.assertEqual(extractor.findall(PAGE), list(extractor.iterfind(chunks)))
+        self.assertEqual([], list(extractor.iterfind([])))
+
+    def testBlocksBiggerThanTheLimit(self):
+        html = PAGE.replace('Last</a>', 'Last</a>' + 'x' * 1000)
+        extractor = _extractor()
+        for size in (1, 10, 100):
+            self.assertEqual(extractor.findall(html),
+                             list(extractor.iterfind(_chunks(html, size), maxBlockSize=200)))
+
+
+if __name__ == '__main__':
+    unittest.main()
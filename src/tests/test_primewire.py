@@ -0,0 +1,91 @@
+# -*- coding: UTF-8 -*-
+'''
+Tests of the extractors of the items of primewire's pages: they must find the same items the regular
+expressions they replaced found on real pages (the fixtures), and stay fast on malformed ones.
+
+Created on Oct 19, 2026
+
+@author: pguedes
+'''
+import os, re, sys, unittest
+
+if sys.version_info[0] > 2:
+    raise unittest.SkipTest("the plugin runs on the python 2 of XBMC")
+
+from tests import kodi
+kodi.install()
+import primewire
+from utils import htmlutils
+from utils.extraction import BlockExtractor
+
+"""the regular expressions the extractors replaced"""
+CATEGORY_ITEM_PATTERN = re.compile(r'<div class="index_item index_item_ie"><a href="([^"]+?)" '
+                                   r'title="Watch ([^\(]+?) \((\d+)\)".+?img.+?src="([^"]+?)".+?</a>.+?</div></div>')
+EPISODE_ITEM_PATTERN = re.compile('<div class="tv_episode_item">.+?href="(.+?)">.+?> - (.+?)</span>.+?</div>',
+                                  re.DOTALL)
+SOURCE_PATTERN = re.compile(r'/external.php\?(.+?)".+?<span class="version_host">(.+?)</span>', re.DOTALL)
+
+"""a block of an episode that never ends, the worst case for the regular expression"""
+UNTERMINATED_EPISODE = '<div class="tv_episode_item"> <a href="/tv-1-Show/season-1-episode-1">' + 'E1 ' * 60
+EPISODE = ('<div class="tv_episode_item"> <a href="/tv-1-Show/season-1-episode-2">E2 '
+           '<span class="tv_episode_name"> - Title</span></a></div>')
+
+
+def countScanned(extractor, scanned):
+    '''get a copy of an extractor that adds how many characters each of its steps scanned to a list'''
+    def counted(step):
+        def countedStep(html, position, end, fields):
+            found = step(html, position, end, fields)
+            scanned.append((found if found >= 0 else end) - position)
+            return found
+        return countedStep
+    return BlockExtractor(extractor.marker, [counted(step) for step in extractor.steps], extractor.singleLine)
+
+
+def loadFixture(name):
+    '''load a page saved in the fixtures folder, cleaned up like the plugin does with the pages it loads'''
+    input = open(os.path.join(os.path.dirname(__file__), "fixtures", name), 'rb')
+    try:
+        return htmlutils.cleanHtml(input.read())
+    finally:
+        input.close()
+
+
+class ExtractorsTest(unittest.TestCase):
+
+    def assertSameItems(self, pattern, extractor, html):
+        expected = pattern.findall(html)
+        self.assertTrue(expected)
+        self.assertEqual(expected, extractor.findall(html))
+        self.assertEqual(expected, list(extractor.iterfind(htmlutils.cleanChunks([html]))))
+
+    def testCategoryItems(self):
+        self.assertSameItems(CATEGORY_ITEM_PATTERN, primewire.CATEGORY_ITEM_EXTRACTOR, loadFixture("category.html"))
+
+    def testEpisodeItems(self):
+        self.assertSameItems(EPISODE_ITEM_PATTERN, primewire.EPISODE_ITEM_EXTRACTOR, loadFixture("episodes.html"))
+
+    def testSourceLinks(self):
+        self.assertSameItems(SOURCE_PATTERN, primewire.SOURCE_EXTRACTOR, loadFixture("sources.html"))
+
+    def testMalformedItemIsSkipped(self):
+        html = loadFixture("category.html")
+        items = primewire.CATEGORY_ITEM_EXTRACTOR.findall(html)
+        malformed = html.replace(' (%s)"' % items[0][2], '"', 1)
+        # the regular expression matched the malformed item up to the year of the next one, losing it
+        self.assertEqual(items[2:], CATEGORY_ITEM_PATTERN.findall(malformed)[1:])
+        self.assertEqual(items[1:], primewire.CATEGORY_ITEM_EXTRACTOR.findall(malformed))
+
+    def testUnterminatedBlocks(self):
+        # the regular expression goes over the rest of the page again for each of these blocks (it takes seconds with
+        # 50 of them, and minutes with 100), the extractor scans each block once
+        html = UNTERMINATED_EPISODE * 2000
+        scanned = []
+        extractor = countScanned(primewire.EPISODE_ITEM_EXTRACTOR, scanned)
+        self.assertEqual([], extractor.findall(html))
+        self.assertTrue(0 < sum(scanned) <= len(html))
+        self.assertEqual([('/tv-1-Show/season-1-episode-2', 'Title')], extractor.findall(html + EPISODE))
+
+
+if __name__ == '__main__':
+    unittest.main()
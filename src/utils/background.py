@@ -0,0 +1,198 @@
+# -*- coding: UTF-8 -*-
+'''
+Work the plugin does in the background, after it answered XBMC.
+
+Tasks run on their own threads and get an event that is set when they are cancelled, which they should check
+regularly (@see: sleep). Submitting a task with the name of a running task cancels the running one, so there
+is at most one task running for each name.
+
+Tasks can also be shared by the plugin's processes (@see: submitShared): submitting one cancels the task with
+the same name in every process, not only in the current one.
+
+When the plugin runs in its own process (instead of in the resident service) the entry point waits for the
+background tasks before exiting (@see: wait), so tasks that wait a long time should only do so in a resident
+process (@see: isResident).
+
+Created on Oct 19, 2026
+
+@author: pguedes
+'''
+import os, threading, time
+import xbmc #@UnresolvedImport
+from utils import logs, storage
+
+log = logs.getLogger("background")
+
+"""how often, in seconds, a shared task checks if it was cancelled by another process"""
+SHARED_POLL_INTERVAL = 1
+
+_tasks = {}
+_tasksLock = threading.Lock()
+_current = threading.local()
+_resident = False
+
+
+class Task(object):
+    '''a function running in the background'''
+
+    def __init__(self, name, function, args):
+        self.name = name
+        self.cancelled = threading.Event()
+        self.__function = function
+        self.__args = args
+        self.__thread = threading.Thread(target=self.__run, name=name)
+        self.__thread.setDaemon(True)
+
+    def __run(self):
+        _current.task = self
+        try:
+            self.__function(self.cancelled, *self.__args)
+        except:
+            log.exception("Background task '%s' failed", self.name)
+        finally:
+            _tasksLock.acquire()
+            try:
+                if _tasks.get(self.name) is self:
+                    del _tasks[self.name]
+            finally:
+                _tasksLock.release()
+
+    def start(self):
+        self.__thread.start()
+
+    def cancel(self):
+        '''ask this task to stop'''
+        self.cancelled.set()
+
+    def join(self, timeout=None):
+        self.__thread.join(timeout)
+
+    def isAlive(self):
+        return self.__thread.isAlive()
+
+
+def submit(name, function, *args):
+    '''run a function in the background, cancelling the task running with the same name (if any)
+    @param name: the name of the task
+    @param function: the function to run, called with the task's cancellation event and the args
+    @param args: the arguments for the function
+    @return: the started Task'''
+    task = Task(name, function, args)
+    _tasksLock.acquire()
+    try:
+        previous = _tasks.get(name)
+        if previous:
+            log.debug("cancelling background task '%s' for a new one", name)
+            previous.cancel()
+        _tasks[name] = task
+    finally:
+        _tasksLock.release()
+    task.start()
+    return task
+
+
+def submitShared(name, function, *args):
+    '''run a function in the background, cancelling the task running with the same name in every plugin process.
+    The task owns a marker in the profile directory, and stops when a task submitted later takes it over.
+    @param name: the name of the task
+    @param function: the function to run, called with the task's cancellation event and the args
+    @param args: the arguments for the function
+    @return: the started Task'''
+    path = storage.getPath("background", name + ".owner")
+    token = "%d-%s" % (os.getpid(), os.urandom(8).encode('hex'))
+    if path:
+        storage.writeAtomically(path, token, sync=False)
+    task = submit(name, function, *args)
+    if path:
+        watcher = threading.Thread(target=_watchOwner, args=(task, path, token), name=name + "-owner")
+        watcher.setDaemon(True)
+        watcher.start()
+    return task
+
+
+def _watchOwner(task, path, token):
+    while task.isAlive() and not task.cancelled.isSet():
+        owner = _readOwner(path)
+        if owner is not None and owner != token:
+            log.debug("background task '%s' was taken over by another process", task.name)
+            task.cancel()
+            return
+        task.join(SHARED_POLL_INTERVAL)
+
+
+def _readOwner(path):
+    try:
+        input = open(path, 'rb')
+        try:
+            return input.read()
+        finally:
+            input.close()
+    except IOError:
+        return None
+
+
+def cancel(name):
+    '''cancel the task running with a name, if any
+    @param name: the name of the task'''
+    _tasksLock.acquire()
+    try:
+        task = _tasks.get(name)
+    finally:
+        _tasksLock.release()
+    if task:
+        task.cancel()
+
+
+def setResident(resident):
+    '''tell if the current process lives as long as XBMC (the resident service), instead of ending with a request
+    @param resident: true in the resident service'''
+    global _resident
+    _resident = resident
+
+
+def isResident():
+    '''check if the current process lives as long as XBMC, so that its tasks may wait for long (ie: for a video
+    to end) without keeping a plugin process alive
+    @return: true in the resident service'''
+    return _resident
+
+
+def isBackground():
+    '''check if the current thread is running a background task (ie: to give way to the user's requests)
+    @return: true if called from a background task'''
+    return getattr(_current, 'task', None) is not None
+
+
+def wait(timeout=None):
+    '''wait for the background tasks to finish, cancelling them if XBMC is shutting down
+    @param timeout: the most time, in seconds, to wait before cancelling them (None to wait until they finish)'''
+    deadline = time.time() + timeout if timeout is not None else None
+    while True:
+        _tasksLock.acquire()
+        try:
+            tasks = list(_tasks.values())
+        finally:
+            _tasksLock.release()
+        if not tasks:
+            return
+        if xbmc.abortRequested or deadline and time.time() >= deadline:
+            for task in tasks:
+                task.cancel()
+            for task in tasks:
+                task.join(1)
+            return
+        tasks[0].join(0.5)
+
+
+def sleep(cancelled, seconds):
+    '''sleep in a background task, waking up if the task is cancelled or XBMC is shutting down
+    @param cancelled: the task's cancellation event
+    @param seconds: how long to sleep
+    @return: true if the task should stop'''
+    deadline = time.time() + seconds
+    while not cancelled.isSet() and not xbmc.abortRequested:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return False
+        cancelled.wait(min(remaining, 1))
+    return True
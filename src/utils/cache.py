@@ -0,0 +1,304 @@
+# -*- coding: UTF-8 -*-
+'''
+A persistent cache for loaded pages and the results parsed from them.
+
+Entries live in the add-on's profile directory (@see: storage) and keep their metadata (expiry time,
+version, HTTP validators, ...) apart from their value. This allows checking or refreshing an entry
+(ie: after a '304 Not Modified' response) without reading or rewriting a potentially big value.
+
+Caches can keep their entries in a file each, or in a Store (@see: store) shared by the plugin's processes, in
+which a lookup reads the entry from memory-mapped files without opening a file for it.
+
+Entries are kept for a while after they expire, so that they can be revalidated or shown while they are
+refreshed, and are then evicted (@see: evictExpired), so that the caches do not grow forever.
+
+When storage is not available every lookup misses and nothing is stored.
+
+Created on Oct 19, 2026
+
+@author: pguedes
+'''
+import cPickle, hashlib, os, time
+from utils import logs, storage, store
+
+log = logs.getLogger("cache")
+
+"""how long, in seconds, entries of the listing caches are kept after they expire (or, for entries that do not
+expire, after they were last stored), expired listings are shown while they are refreshed until then"""
+EXPIRED_KEEP_TIME = 7 * 24 * 60 * 60
+"""how often, in seconds, the caches are cleaned of the entries to evict"""
+EVICTION_INTERVAL = 24 * 60 * 60
+
+_evictable = []
+
+
+class Cache(object):
+    '''a named cache of entries with metadata and a value'''
+
+    def __init__(self, name, raw=False, stored=False, keepTime=None):
+        '''create a cache
+        @param name: the name of this cache (the folder it uses in the profile directory)
+        @param raw: if values are strings stored as they are, instead of pickled, which allows writing and
+            reading them in chunks (@see: writeValue, iterValue)
+        @param stored: if entries are kept in a Store instead of a file each (@see: store)
+        @param keepTime: how long, in seconds, entries are kept after they expire (or after they were last stored,
+            for entries that do not expire) before they are evicted (None to keep them forever)'''
+        self.name = name
+        self.raw = raw
+        self.store = stored and store.Store(name) or None
+        self.keepTime = keepTime
+        if keepTime is not None:
+            _evictable.append(self)
+
+    def __path(self, key, extension):
+        return storage.getPath("cache", self.name, "%s.%s" % (hashlib.md5(key).hexdigest(), extension))
+
+    def __load(self, key, extension, raw=False):
+        if self.store:
+            data = self.store.get("%s.%s" % (key, extension))
+        else:
+            data = self.__read(self.__path(key, extension))
+        if raw:
+            return data
+        return self.__unpickle(data, key)
+
+    def __unpickle(self, data, key):
+        if data is None:
+            return None
+        try:
+            return cPickle.loads(data)
+        except:
+            log.exception("Failed to load '%s' of cache '%s'", key, self.name)
+            return None
+
+    def __read(self, path):
+        if not path or not os.path.isfile(path):
+            return None
+        try:
+            input = open(path, 'rb')
+            try:
+                return input.read()
+            finally:
+                input.close()
+        except IOError:
+            log.exception("Failed to load cache file '%s'", path)
+            return None
+
+    def __save(self, key, extension, value, raw=False):
+        data = value if raw else cPickle.dumps(value, cPickle.HIGHEST_PROTOCOL)
+        if self.store:
+            return self.store.put("%s.%s" % (key, extension), data)
+        path = self.__path(key, extension)
+        if not path:
+            return False
+        storage.writeAtomically(path, data)
+        return True
+
+    def getMeta(self, key):
+        '''get the metadata for an entry, whether it is expired or not
+        @param key: the key of the entry
+        @return: the metadata dict of the entry, or None if there is no such entry'''
+        return self.__load(key, 'meta')
+
+    def getValue(self, key):
+        '''get the value of an entry, whether it is expired or not
+        @param key: the key of the entry
+        @return: the value of the entry or None if there is no such entry'''
+        return self.__load(key, 'data', self.raw)
+
+    def iterValue(self, key, chunkSize):
+        '''read the value of a raw entry in chunks, whether it is expired or not
+        @param key: the key of the entry
+        @param chunkSize: the size of the chunks to read
+        @return: a generator of chunks of the value, or None if there is no such entry'''
+        if self.store:
+            value = self.store.get(key + ".data")
+            if value is None:
+                return None
+            return (value[start:start + chunkSize] for start in range(0, len(value), chunkSize))
+        path = self.__path(key, 'data')
+        if not path or not os.path.isfile(path):
+            return None
+        input = open(path, 'rb')
+
+        def chunks():
+            try:
+                for chunk in iter(lambda: input.read(chunkSize), ''):
+                    yield chunk
+            finally:
+                input.close()
+        return chunks()
+
+    def get(self, key):
+        '''get the value of an entry if it did not expire
+        @param key: the key of the entry
+        @return: the value of the entry or None if there is no fresh entry'''
+        if isFresh(self.getMeta(key)):
+            return self.getValue(key)
+
+    def put(self, key, value, ttl=None, **meta):
+        '''store an entry
+        @param key: the key of the entry
+        @param value: the value to store (must be pickleable)
+        @param ttl: how long, in seconds, this entry is fresh (None for entries that do not expire)
+        @param meta: extra metadata to keep for this entry'''
+        self.__save(key, 'data', value, self.raw)
+        self.touch(key, ttl, **meta)
+
+    def writeValue(self, key, chunks):
+        '''write the value of a raw entry from chunks, without holding all of it in memory.
+        The metadata of the entry is not changed (@see: touch). Values kept in a Store are held in memory, so
+        caches of big values keep them in files.
+        @param key: the key of the entry
+        @param chunks: an iterable with the chunks of the value
+        @return: true if the value was written, false if there is no storage (the chunks are not read then)
+        @raise IOError: if the chunks were read but the value could not be written'''
+        if self.store:
+            if not self.store.isAvailable():
+                return False
+            if not self.__save(key, 'data', "".join(chunks), True):
+                raise IOError("Failed to store '%s' in cache '%s'" % (key, self.name))
+            return True
+        path = self.__path(key, 'data')
+        if not path:
+            return False
+        storage.writeChunksAtomically(path, chunks)
+        return True
+
+    def touch(self, key, ttl=None, **meta):
+        '''refresh the metadata of an entry without rewriting its value
+        @param key: the key of the entry
+        @param ttl: how long, from now, the entry is fresh (None for entries that do not expire)
+        @param meta: metadata to update for this entry'''
+        current = self.getMeta(key) or {}
+        current.update(meta)
+        current['expires'] = time.time() + ttl if ttl is not None else None
+        current['touched'] = time.time()
+        self.__save(key, 'meta', current)
+
+    def getVersioned(self, key, version, compute, ttl=None):
+        '''get a value computed from a certain version of some data, computing it only if needed
+        @param key: the key of the entry
+        @param version: the version of the data the value is computed from
+        @param compute: a function that computes the value, called if there is no value for this version
+        @param ttl: how long, in seconds, the value is fresh (None for values that do not expire)
+        @return: the value for that version of the data'''
+        meta = self.getMeta(key)
+        if meta and meta.get('version') == version:
+            value = self.getValue(key)
+            if value is not None:
+                log.debug("reusing value for '%s' version '%s'", key, version)
+                if ttl is not None or self.__isAging(meta):
+                    self.touch(key, ttl)
+                return value
+        value = compute()
+        self.put(key, value, ttl, version=version)
+        return value
+
+
+    def __isAging(self, meta):
+        '''check if an entry that is still used is halfway to being evicted (and should be touched to keep it)'''
+        return self.keepTime is not None and meta.get('touched', 0) + self.keepTime / 2 < time.time()
+
+    def isEvicted(self, meta, now=None):
+        '''check if an entry should be evicted
+        @param meta: the metadata of the entry (can be None)
+        @param now: the time to check at (defaults to now)
+        @return: true if the entry has no metadata, or expired (or was stored) more than keepTime seconds ago'''
+        if self.keepTime is None:
+            return False
+        if not meta:
+            return True
+        return max(meta.get('expires') or 0, meta.get('touched', 0)) + self.keepTime < (now or time.time())
+
+    def evict(self):
+        '''drop the entries of this cache that should be evicted (@see: isEvicted)
+        @return: the number of entries that were kept'''
+        now = time.time()
+        if self.store:
+            kept = {}
+
+            def keep(key):
+                entry = key.rsplit('.', 1)[0]
+                if entry not in kept:
+                    kept[entry] = not self.isEvicted(self.getMeta(entry), now)
+                return kept[entry]
+            self.store.compact(keep)
+            return len([entry for entry in kept if kept[entry]])
+
+        directory = storage.getPath("cache", self.name, "")
+        if not directory or not os.path.isdir(directory):
+            return 0
+        names = set(os.listdir(directory))
+        kept = 0
+        for name in names:
+            entry, extension = os.path.splitext(name)
+            path = os.path.join(directory, name)
+            if extension == '.meta':
+                meta = self.__unpickle(self.__read(path), entry)
+                if not self.isEvicted(meta, now):
+                    kept += 1
+                    continue
+                _remove(os.path.join(directory, entry + '.data'))
+                _remove(path)
+            elif extension == '.data' and entry + '.meta' not in names:
+                # a value without metadata, unless it is being stored right now
+                if os.path.getmtime(path) + self.keepTime < now:
+                    _remove(path)
+        return kept
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        # evicted by another process
+        pass
+
+
+def isEvictionDue():
+    '''check if it is time to clean the caches of the entries to evict
+    @return: true if the caches were not cleaned in the last EVICTION_INTERVAL seconds'''
+    path = storage.getPath("cache", "evicted")
+    return bool(path) and (not os.path.isfile(path) or os.path.getmtime(path) + EVICTION_INTERVAL < time.time())
+
+
+def evictExpired(cancelled):
+    '''clean the caches of the entries to evict (a background task, @see: Cache.evict)
+    @param cancelled: the event set when this task is cancelled'''
+    path = storage.getPath("cache", "evicted")
+    if not path:
+        return
+    # other instances should not clean the caches at the same time
+    storage.writeAtomically(path, str(time.time()))
+    for evictable in _evictable:
+        if cancelled.isSet():
+            return
+        kept = evictable.evict()
+        log.debug("evicted expired entries of cache '%s', %d kept", evictable.name, kept)
+
+
+def isFresh(meta):
+    '''check if the metadata of an entry says it is still fresh
+    @param meta: the metadata of the entry (can be None)
+    @return: true if the entry exists and did not expire'''
+    if not meta:
+        return False
+    expires = meta.get('expires')
+    return expires is None or expires > time.time()
+
+
+"""the cache of pages loaded over http, in a file each so that they are streamed in bounded memory"""
+pages = Cache("pages", raw=True, keepTime=EXPIRED_KEEP_TIME)
+"""the cache of results parsed from pages"""
+parsed = Cache("parsed", stored=True, keepTime=EXPIRED_KEEP_TIME)
+"""the cache of the hoster links parsed from source pages"""
+sources = Cache("sources", stored=True, keepTime=EXPIRED_KEEP_TIME)
+"""the cache of playable links resolved from hoster links"""
+resolved = Cache("resolved", stored=True, keepTime=0)
+"""the cache of the hosters supported by the installed resolvers"""
+hosters = Cache("hosters")
+"""the cache of the metadata of the listed items (@see: plugin.lookupMetadata)"""
+metadata = Cache("metadata", stored=True, keepTime=EXPIRED_KEEP_TIME)
+"""the cache of hoster links that failed to resolve, and how they failed"""
+deadLinks = Cache("deadlinks", stored=True, keepTime=0)
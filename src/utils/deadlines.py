@@ -0,0 +1,355 @@
+# -*- coding: UTF-8 -*-
+'''
+Deadlines for the plugin's http requests.
+
+Every request gets a connect timeout (how long to wait for the server to answer with the response headers)
+and a read timeout (how long to wait for each read of the response body), depending on the class of its url
+(@see: getUrlClass), so that a stalled server never freezes XBMC's listing. The read timeout needs an opener
+made by buildOpener, with other openers reads wait as long as the connect timeout.
+
+Requests can also be hedged: when the first attempt did not get an answer in the usual time (a percentile of
+the latencies measured for its url class) a second attempt is started and whichever answers first is used.
+Only requests without data (GETs) are hedged, and only when their host's rate limit has a token for the second
+attempt right away (@see: ratelimit.tryAcquire).
+
+Latencies, timeouts and hedges are counted for each url class in the profile directory, shared by every
+plugin instance, so that the timeouts and the hedging percentile can be tuned (@see: getStats). They are counted
+in memory and saved once per invocation (@see: saveStats), merged with what other instances saved meanwhile.
+
+A thread can also measure the requests it makes and the bytes it reads (@see: Usage, measure), ie: to keep
+work done in the background within a budget.
+
+Created on Oct 19, 2026
+
+@author: pguedes
+'''
+import cPickle, functools, httplib, os, socket, sys, threading, time, Queue, urllib2
+from utils import filelock, logs, mirrors, ratelimit, storage
+
+log = logs.getLogger("deadlines")
+
+PAGE, SEARCH, AJAX, HOSTER = 'page', 'search', 'ajax', 'hoster'
+
+"""the (connect, read) timeouts, in seconds, for each url class"""
+TIMEOUTS = {PAGE: (5, 20),
+            SEARCH: (5, 30),
+            AJAX: (5, 15),
+            HOSTER: (10, 30)}
+
+"""the percentile of the latencies of an url class after which requests are hedged"""
+HEDGE_PERCENTILE = 95
+"""the least time, in seconds, to wait before hedging a request (so fast servers do not get every request twice)"""
+MIN_HEDGE_DELAY = 0.5
+"""how many latencies must be measured for an url class before its requests are hedged"""
+MIN_SAMPLES = 20
+"""how many of the latest latencies are kept for each url class"""
+MAX_SAMPLES = 100
+
+STATS_LOCK_TIMEOUT = 5
+
+_hedging = False
+_stats = None
+_pending = {}
+_statsLock = threading.Lock()
+_measuring = threading.local()
+
+
+class Usage(object):
+    '''the requests made and the bytes read by a thread while it measures them (@see: measure)'''
+
+    def __init__(self):
+        self.requests = 0
+        self.bytes = 0
+
+
+def measure(usage):
+    '''measure the requests made by the current thread
+    @param usage: the Usage to count the requests and bytes in, None to stop measuring'''
+    _measuring.usage = usage
+
+
+def setHedging(enabled):
+    '''enable or disable hedged requests
+    @param enabled: true to hedge requests'''
+    global _hedging
+    _hedging = enabled
+
+
+def getUrlClass(url, ajax=False):
+    '''classify an url, to choose the timeouts for requests to it
+    @param url: the url, as given to htmlutils (relative urls are pages of the site, @see: mirrors)
+    @param ajax: if the request is an XMLHttpRequest
+    @return: the url class (PAGE, SEARCH, AJAX or HOSTER)'''
+    if ajax:
+        return AJAX
+    if not mirrors.isSite(url):
+        return HOSTER
+    if url.find('search_keywords=') >= 0:
+        return SEARCH
+    return PAGE
+
+
+def buildOpener(*handlers):
+    '''build an urllib2 opener whose responses wait for each read within the read timeout of their requests
+    (@see: openRequest)
+    @param handlers: the other handlers of the opener (ie: a cookie processor)
+    @return: the opener'''
+    return urllib2.build_opener(*(_HANDLERS + handlers))
+
+
+def openRequest(opener, makeRequest, data=None, urlClass=PAGE):
+    '''open a request within the deadlines of its url class, hedging it if enabled
+    @param opener: the urllib2 opener to use
+    @param makeRequest: a function that creates the urllib2.Request (called once for each attempt)
+    @param data: data to be POSTed on the request
+    @param urlClass: the class of the request's url (@see: getUrlClass)
+    @return: the response
+    @raise urllib2.URLError: if the request failed
+    @raise socket.timeout: if the request timed out'''
+    usage = getattr(_measuring, 'usage', None)
+    delay = None
+    if _hedging and data is None:
+        delay = getHedgeDelay(urlClass)
+    if delay is None or delay >= TIMEOUTS[urlClass][0]:
+        return _attempt(opener, makeRequest(), data, urlClass, usage)
+    return _hedged(opener, makeRequest, urlClass, delay, usage)
+
+
+def _attempt(opener, request, data, urlClass, usage):
+    connectTimeout, readTimeout = TIMEOUTS[urlClass]
+    # for the responses of openers made by buildOpener
+    request.readTimeout = readTimeout
+    if usage:
+        usage.requests += 1
+    start = time.time()
+    try:
+        response = opener.open(request, data, connectTimeout)
+    except urllib2.HTTPError:
+        # an http error is still an answer from the server
+        _update(urlClass, latency=time.time() - start)
+        raise
+    except (urllib2.URLError, socket.error) as e:
+        if isTimeout(e):
+            log.warning("Timed out after %ds waiting for '%s'", connectTimeout, request.get_full_url())
+            _update(urlClass, timeouts=1)
+        raise
+    _update(urlClass, latency=time.time() - start)
+    _measureReads(response, urlClass, usage)
+    return response
+
+
+def _hedged(opener, makeRequest, urlClass, delay, usage):
+    answers = Queue.Queue()
+
+    def attempt(number, request):
+        try:
+            answers.put((number, _attempt(opener, request, None, urlClass, usage), None))
+        except:
+            answers.put((number, None, sys.exc_info()[1]))
+
+    def start(number, request):
+        worker = threading.Thread(target=attempt, args=(number, request))
+        worker.setDaemon(True)
+        worker.start()
+
+    start(1, makeRequest())
+    try:
+        number, response, error = answers.get(timeout=delay)
+    except Queue.Empty:
+        number = None
+    if number is not None:
+        return _answer(response, error)
+
+    request = makeRequest()
+    # the first attempt took a token of the rate limit, a hedge is not worth waiting for another one
+    if not ratelimit.tryAcquire(request.get_full_url()):
+        log.debug("no answer after %.2fs, but no token to hedge the request", delay)
+        number, response, error = answers.get()
+        return _answer(response, error)
+    log.debug("no answer after %.2fs, hedging the request", delay)
+    _update(urlClass, hedges=1)
+    start(2, request)
+    pending = 2
+    firstError = None
+    while pending:
+        number, response, error = answers.get()
+        pending -= 1
+        # an http error is still an answer from the server (ie: 304 Not Modified)
+        if response is not None or isinstance(error, urllib2.HTTPError):
+            if number == 2:
+                _update(urlClass, hedgeWins=1)
+            if pending:
+                _closeLateAnswer(answers)
+            return _answer(response, error)
+        firstError = firstError or error
+    raise firstError
+
+
+def _answer(response, error):
+    if error is not None:
+        raise error
+    return response
+
+
+def _closeLateAnswer(answers):
+    def close():
+        number, response, error = answers.get()
+        for late in (response, error):
+            if hasattr(late, 'close'):
+                late.close()
+
+    closer = threading.Thread(target=close)
+    closer.setDaemon(True)
+    closer.start()
+
+
+def isTimeout(error):
+    '''check if an error of a request is a timeout
+    @param error: the error raised by the request
+    @return: true if the request timed out'''
+    return isinstance(error, socket.timeout) or isinstance(getattr(error, 'reason', None), socket.timeout)
+
+
+class _Response(httplib.HTTPResponse):
+    '''a response that waits for its headers within the timeout of its connection (the connect timeout given to
+    the opener), and for each read of its body within a read timeout'''
+
+    def __init__(self, sock, *args, **kwargs):
+        self.__readTimeout = kwargs.pop('readTimeout')
+        httplib.HTTPResponse.__init__(self, sock, *args, **kwargs)
+        self.__sock = sock
+
+    def begin(self):
+        httplib.HTTPResponse.begin(self)
+        self.__sock.settimeout(self.__readTimeout)
+
+
+class _ReadTimeouts:
+    '''a mixin for the http handlers of urllib2 that gives the responses to requests the read timeout of the
+    requests (@see: _attempt)'''
+
+    def do_open(self, connectionClass, request, **kwargs):
+        readTimeout = getattr(request, 'readTimeout', None)
+
+        def connect(host, **connectionArgs):
+            connection = connectionClass(host, **connectionArgs)
+            if readTimeout is not None:
+                connection.response_class = functools.partial(_Response, readTimeout=readTimeout)
+            return connection
+        return urllib2.AbstractHTTPHandler.do_open(self, connect, request, **kwargs)
+
+
+class _HTTPHandler(_ReadTimeouts, urllib2.HTTPHandler):
+    pass
+
+"""the handlers buildOpener uses instead of the default http handlers of urllib2"""
+_HANDLERS = (_HTTPHandler,)
+
+if hasattr(urllib2, 'HTTPSHandler'):
+    class _HTTPSHandler(_ReadTimeouts, urllib2.HTTPSHandler):
+        pass
+
+    _HANDLERS += (_HTTPSHandler,)
+
+
+def _measureReads(response, urlClass, usage):
+    read = response.read
+
+    def measuredRead(*args):
+        try:
+            data = read(*args)
+        except socket.timeout:
+            log.warning("Timed out reading '%s'", response.geturl())
+            _update(urlClass, timeouts=1)
+            raise
+        if usage:
+            usage.bytes += len(data)
+        return data
+
+    response.read = measuredRead
+
+
+def getHedgeDelay(urlClass):
+    '''get how long to wait for the first attempt of a request before hedging it
+    @param urlClass: the class of the request's url
+    @return: the delay in seconds, or None if not enough latencies were measured yet'''
+    latencies = sorted(_loadStats().get(urlClass, {}).get('latencies', ()))
+    if len(latencies) < MIN_SAMPLES:
+        return None
+    return max(MIN_HEDGE_DELAY, latencies[min(len(latencies) - 1, len(latencies) * HEDGE_PERCENTILE // 100)])
+
+
+def getStats():
+    '''get the statistics of the requests, to tune the deadlines
+    @return: a dict with a dict for each url class with its latest latencies and its counts of requests,
+        timeouts, hedges and hedges that answered first (hedgeWins)'''
+    return _loadStats()
+
+
+def _loadStats():
+    global _stats
+    if _stats is None:
+        _stats = _readStats(storage.getPath("stats", "http.pickle"))
+    return _stats
+
+
+def _readStats(path):
+    if not path or not os.path.isfile(path):
+        return {}
+    try:
+        stats = open(path, 'rb')
+        try:
+            return cPickle.load(stats)
+        finally:
+            stats.close()
+    except (IOError, EOFError, cPickle.UnpicklingError):
+        log.exception("Failed to read http statistics from '%s'", path)
+        return {}
+
+
+def _update(urlClass, latency=None, **counts):
+    '''add a measured latency and/or counts to the statistics of an url class (they are saved later, @see: saveStats)'''
+    _statsLock.acquire()
+    try:
+        _add(_loadStats(), urlClass, latency, counts)
+        _add(_pending, urlClass, latency, counts)
+    finally:
+        _statsLock.release()
+
+
+def _add(stats, urlClass, latency, counts):
+    classStats = stats.setdefault(urlClass, {'latencies': [], 'requests': 0, 'timeouts': 0, 'hedges': 0,
+                                             'hedgeWins': 0})
+    if latency is not None:
+        classStats['requests'] += 1
+        classStats['latencies'] = (classStats['latencies'] + [latency])[-MAX_SAMPLES:]
+    for counter, count in counts.items():
+        classStats[counter] = classStats.get(counter, 0) + count
+
+
+def saveStats():
+    '''save the statistics of the requests made since they were last saved, merging them with what other instances
+    saved in the meantime (called once per invocation, when its requests are done)'''
+    global _stats, _pending
+    _statsLock.acquire()
+    try:
+        path = storage.getPath("stats", "http.pickle")
+        if not _pending or not path:
+            return
+        try:
+            with filelock.FileLock(path + ".lock", STATS_LOCK_TIMEOUT):
+                stats = _readStats(path)
+                for urlClass, pending in _pending.items():
+                    latencies = pending.pop('latencies')
+                    for latency in latencies:
+                        _add(stats, urlClass, latency, {})
+                    # requests were counted with the latencies
+                    pending['requests'] -= len(latencies)
+                    _add(stats, urlClass, None, pending)
+                storage.writeAtomically(path, cPickle.dumps(stats, cPickle.HIGHEST_PROTOCOL), sync=False)
+                _stats = stats
+        except (filelock.LockTimeout, IOError, OSError):
+            log.exception("Failed to save http statistics")
+        _pending = {}
+    finally:
+        _statsLock.release()
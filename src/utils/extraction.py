@@ -0,0 +1,147 @@
+# -*- coding: UTF-8 -*-
+'''
+Linear time extraction of repeated items from html pages.
+
+Regular expressions made of chains of lazy matches (.+?) backtrack a lot when they are matched over a
+whole page, especially when some item on the page is malformed. A BlockExtractor instead splits the page
+in blocks, each starting at a marker and ending before the next one, and scans each block once with a list
+of steps (@see: expect, skipTo, captureTo). Each step searches forward from where the previous one ended
+and never goes back, so extracting from a page costs time proportional to its size.
+
+Steps mirror the regular expressions they replace: skipTo(x) is '.+?x', captureTo(x) is '(.+?)x', the only
+difference being that the first occurrence of a literal is always used (no backtracking to later ones).
+
+Created on Oct 19, 2026
+
+@author: pguedes
+'''
+
+"""blocks bigger than this are not kept whole in memory when extracting from chunks (@see: BlockExtractor.iterfind)"""
+MAX_BLOCK_SIZE = 64 * 1024
+
+
+def expect(literal):
+    '''a step that requires a literal right where the previous step ended (regex: 'literal')'''
+    def step(html, position, end, fields):
+        if html.startswith(literal, position, end):
+            return position + len(literal)
+        return -1
+    return step
+
+
+def skipTo(literal):
+    '''a step that skips at least one character up to the end of a literal (regex: '.+?literal')'''
+    def step(html, position, end, fields):
+        index = html.find(literal, position + 1, end)
+        if index < 0:
+            return -1
+        return index + len(literal)
+    return step
+
+
+def captureTo(delimiter, excluded=None, validate=None):
+    '''a step that captures at least one character up to a delimiter (regex: '(.+?)delimiter')
+    @param delimiter: the literal that ends the captured field
+    @param excluded: characters the field cannot contain (regex: '([^excluded]+?)delimiter')
+    @param validate: a function that checks the captured field (ie: str.isdigit for digits only)'''
+    def step(html, position, end, fields):
+        index = html.find(delimiter, position + 1, end)
+        if index < 0:
+            return -1
+        value = html[position:index]
+        if excluded:
+            for character in excluded:
+                if character in value:
+                    return -1
+        if validate and not validate(value):
+            return -1
+        fields.append(value)
+        return index + len(delimiter)
+    return step
+
+
+class BlockExtractor(object):
+    '''extracts a tuple of fields from each block of a page that starts with a marker'''
+
+    def __init__(self, marker, steps, singleLine=False):
+        '''create an extractor
+        @param marker: the literal that starts each block
+        @param steps: the steps to scan each block with, after its marker
+        @param singleLine: if blocks end at the end of the line they start in (like regexes without re.DOTALL)'''
+        self.marker = marker
+        self.steps = steps
+        self.singleLine = singleLine
+
+    def blocks(self, html):
+        '''find the blocks of a page
+        @param html: the page
+        @return: a generator of (start, end) positions of each block'''
+        start = html.find(self.marker)
+        while start >= 0:
+            nextStart = html.find(self.marker, start + len(self.marker))
+            yield start, self.__blockEnd(html, start, nextStart >= 0 and nextStart or len(html))
+            start = nextStart
+
+    def __blockEnd(self, html, start, end):
+        if self.singleLine:
+            newline = html.find('\n', start, end)
+            if newline >= 0:
+                return newline
+        return end
+
+    def extract(self, html, start, end):
+        '''extract the fields from a block
+        @param html: the page
+        @param start: where the block starts (at its marker)
+        @param end: where the block ends
+        @return: the tuple of fields captured from the block, or None if the block does not match the steps'''
+        position = start + len(self.marker)
+        fields = []
+        for step in self.steps:
+            position = step(html, position, end, fields)
+            if position < 0:
+                return None
+        return tuple(fields)
+
+    def findall(self, html):
+        '''extract the fields of every block of a page (like re.findall)
+        @param html: the page
+        @return: a list with a tuple of fields for each block that matches the steps'''
+        results = []
+        for start, end in self.blocks(html):
+            fields = self.extract(html, start, end)
+            if fields is not None:
+                results.append(fields)
+        return results
+
+    def iterfind(self, chunks, maxBlockSize=MAX_BLOCK_SIZE):
+        '''extract the fields of every block of a page read in chunks, keeping about one block in memory.
+        Each block is extracted as soon as the next one starts, and then dropped.
+        @param chunks: an iterable with the chunks of the page
+        @param maxBlockSize: blocks bigger than this are extracted with what was read of them
+        @return: a generator of tuples of fields for each block that matches the steps'''
+        pending = ""
+        for chunk in chunks:
+            pending += chunk
+            start = pending.find(self.marker)
+            if start < 0:
+                # only keep what may be the beginning of a marker
+                pending = pending[max(0, len(pending) - len(self.marker) + 1):]
+                continue
+            nextStart = pending.find(self.marker, start + len(self.marker))
+            while nextStart >= 0:
+                fields = self.extract(pending, start, self.__blockEnd(pending, start, nextStart))
+                if fields is not None:
+                    yield fields
+                start = nextStart
+                nextStart = pending.find(self.marker, start + len(self.marker))
+            pending = pending[start:]
+            if len(pending) > maxBlockSize:
+                fields = self.extract(pending, 0, self.__blockEnd(pending, 0, len(pending)))
+                if fields is not None:
+                    yield fields
+                pending = ""
+        if pending.startswith(self.marker):
+            fields = self.extract(pending, 0, self.__blockEnd(pending, 0, len(pending)))
+            if fields is not None:
+                yield fields
@@ -0,0 +1,146 @@
+# -*- coding: UTF-8 -*-
+'''
+Locks shared by all the processes of this add-on.
+
+XBMC may run several instances of the plugin at the same time (ie: a container refresh while a listing
+is still loading), so state kept in files must be updated under a FileLock.
+Locking uses fcntl where available and msvcrt on windows. If neither is available the lock only works
+between the threads of the current process. A lock without a file (ie: when there is no storage) does
+not exclude anything.
+Temporary locks (ie: one per page being loaded) remove their file when released, so that lock files do not
+pile up; this needs fcntl, elsewhere their files are kept.
+
+Created on Oct 19, 2026
+
+@author: pguedes
+'''
+import os, threading, time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
+
+class LockTimeout(Exception):
+    '''exception raised when a lock could not be acquired in time'''
+    pass
+
+
+class FileLock(object):
+    '''an exclusive lock on a file.
+    Can be used as a context manager:
+        with FileLock(path):
+            ...'''
+
+    POLL_INTERVAL = 0.05
+
+    def __init__(self, path, timeout=None, temporary=False):
+        '''create a lock (not acquired)
+        @param path: the lock file to use (None for a lock that does not exclude anything)
+        @param timeout: how long to wait, in seconds, when used as a context manager (None to wait forever)
+        @param temporary: if the lock file is removed when the lock is released'''
+        self.path = path
+        self.timeout = timeout
+        self.temporary = temporary and fcntl is not None
+        self.__file = None
+        self.__threadLock = path and _threadLock(path) or threading.Lock()
+
+    def acquire(self, blocking=True, timeout=None):
+        '''acquire this lock
+        @param blocking: if False, does not wait for the lock
+        @param timeout: how long to wait, in seconds, if blocking (None to wait forever)
+        @return: true if the lock was acquired, false otherwise'''
+        deadline = time.time() + timeout if timeout is not None else None
+        while not self.__threadLock.acquire(False):
+            if not blocking or deadline and time.time() >= deadline:
+                return False
+            time.sleep(self.POLL_INTERVAL)
+
+        if not self.path or not (fcntl or msvcrt):
+            return True
+
+        lockFile = open(self.path, 'a+b')
+        while True:
+            if _lockFile(lockFile):
+                if not self.temporary or _isLinked(lockFile, self.path):
+                    self.__file = lockFile
+                    return True
+                # the file was removed by the instance that held the lock before, lock the one at its path now
+                lockFile.close()
+                lockFile = open(self.path, 'a+b')
+                continue
+            if not blocking or deadline and time.time() >= deadline:
+                lockFile.close()
+                self.__threadLock.release()
+                return False
+            time.sleep(self.POLL_INTERVAL)
+
+    def release(self):
+        '''release this lock'''
+        if self.__file:
+            if self.temporary:
+                # removed while still locked: the instances waiting on this file will find it is gone
+                try:
+                    os.remove(self.path)
+                except OSError:
+                    pass
+            _unlockFile(self.__file)
+            self.__file.close()
+            self.__file = None
+        self.__threadLock.release()
+
+    def __enter__(self):
+        if not self.acquire(timeout=self.timeout):
+            raise LockTimeout("Timed out waiting for lock '%s'" % self.path)
+        return self
+
+    def __exit__(self, *excInfo):
+        self.release()
+
+
+__threadLocks = {}
+__threadLocksLock = threading.Lock()
+
+
+def _threadLock(path):
+    '''get the lock used between the threads of this process for a lock file
+    (file locks do not exclude the threads of the process that holds them)'''
+    __threadLocksLock.acquire()
+    try:
+        return __threadLocks.setdefault(path, threading.Lock())
+    finally:
+        __threadLocksLock.release()
+
+
+def _lockFile(lockFile):
+    try:
+        if fcntl:
+            fcntl.flock(lockFile.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            lockFile.seek(0)
+            msvcrt.locking(lockFile.fileno(), msvcrt.LK_NBLCK, 1)
+        return True
+    except (IOError, OSError):
+        return False
+
+
+def _isLinked(lockFile, path):
+    '''check if an open lock file is still the file at its path (temporary lock files are removed on release)'''
+    try:
+        return os.path.samestat(os.fstat(lockFile.fileno()), os.stat(path))
+    except OSError:
+        return False
+
+
+def _unlockFile(lockFile):
+    if fcntl:
+        fcntl.flock(lockFile.fileno(), fcntl.LOCK_UN)
+    else:
+        lockFile.seek(0)
+        msvcrt.locking(lockFile.fileno(), msvcrt.LK_UNLCK, 1)
@@ -1,20 +1,37 @@
 # -*- coding: UTF-8 -*-
 import re, urllib2
-import logging
+import hashlib, os, threading
+from utils import cache, deadlines, filelock, logs, mirrors, ratelimit, storage
 
-log = logging.getLogger("htmlutils")
+log = logs.getLogger("htmlutils")
+
+"""how long, in seconds, to wait for another plugin instance loading the same page"""
+SINGLE_FLIGHT_TIMEOUT = 30
+
+"""the size of the chunks pages are read in, when they are streamed"""
+CHUNK_SIZE = 16 * 1024
+"""the longest line that is kept in memory to clean up streamed pages (@see: cleanChunks)"""
+MAX_CLEANUP_WINDOW = 4 * CHUNK_SIZE
+
+"""the opener for requests that do not use cookies"""
+_defaultOpener = deadlines.buildOpener()
 
 class HttpClient(object):
     '''an HTTP client facade to handle the http interface required by linkresolvers.
     This client supports cookies via cookielib.'''
-    def __init__(self, useCookies=False):
+    def __init__(self, useCookies=False, cookies=None):
         '''create a new http client.
         @param useCookies: if the client should support cookies
-        @return: true if this client uses cookies, false otherwise'''
-        if useCookies:
+        @param cookies: a cookies file to use, this client will share the cookie session for that file
+            with every other request using it (implies useCookies)'''
+        self.cookieJar = None
+        self.__session = None
+        if cookies:
+            self.__useSession(getCookieSession(cookies))
+        elif useCookies:
             self.__setupCookieHandling()
         else:
-            self.opener = urllib2.urlopen
+            self.opener = _defaultOpener
 
     def usesCookies(self):
         '''check if this http client uses cookies.
@@ -23,11 +40,13 @@ class HttpClient(object):
 
     def loadCookies(self, file):
         '''loads cookies for this client from a file.
+        This client starts using the cookie session for that file, which is only loaded once per process.
         @param file: the file to load cookies from'''
-        import os
-        if os.path.isfile(file):
-            log.debug("loading cookies from file '%s'" % file)
-            self.cookieJar.load(file)
+        session = getCookieSession(file)
+        if self.cookieJar is not None and self.cookieJar is not session.cookieJar:
+            for cookie in self.cookieJar:
+                session.cookieJar.set_cookie(cookie)
+        self.__useSession(session)
 
     def getCookiesAsHeaderString(self):
         '''get the cookies stored in this client as a string that can be used in an http header
@@ -37,20 +56,28 @@ class HttpClient(object):
 
     def saveCookies(self, file, skipDiscard=False):
         '''save the cookies in this client's cookie jar to a file.
+        Cookies are only written if they changed since they were loaded or last saved.
         @param file: the file to save cookies to
         @param skipDiscard: if discarded cookies should still be saved'''
         if self.cookieJar:
-            self.cookieJar.save(file, ignore_discard=skipDiscard)
-
-    def __setupCookieHandling(self, cookiesFile=None):
-        '''creates a cookie jar, loads the cookies from a file and sets up the urllib2 opener to keep track 
-        of cookies on requests done by this client.
-        @param cookiesFile: the file with cookies to load
-        @return: the cookie jar loaded'''
+            session = getCookieSession(file)
+            if session.cookieJar is not self.cookieJar:
+                for cookie in self.cookieJar:
+                    session.cookieJar.set_cookie(cookie)
+            session.save(skipDiscard)
+
+    def __useSession(self, session):
+        self.__session = session
+        self.cookieJar = session.cookieJar
+        self.opener = session.opener
+
+    def __setupCookieHandling(self):
+        '''creates a cookie jar and sets up the urllib2 opener to keep track of cookies on requests done
+        by this client.'''
         import cookielib
 
         self.cookieJar = cookielib.LWPCookieJar()
-        self.opener = urllib2.build_opener(urllib2.HTTPCookieProcessor(self.cookieJar))
+        self.opener = deadlines.buildOpener(urllib2.HTTPCookieProcessor(self.cookieJar))
 
     def resolveRedirect(self, url):
         return self.get(url, returnResponse=True).url
@@ -62,21 +89,7 @@ class HttpClient(object):
         @param data: data to be POSTed on the request
         @param returnResponse: if True, will return the response object before reading instead of data read
         @return: the loaded html, or the response if returnResponse was true'''
-        target = getTarget(url)
-
-        req = urllib2.Request(target)
-        req.add_header('Accept', 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8')
-        req.add_header('User-Agent', 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/534.30 (KHTML, like Gecko) Ubuntu/11.04 Chromium/12.0.742.112 Chrome/12.0.742.112 Safari/534.30')
-        if ajax:
-            req.add_header('X-Requested-With', 'XMLHttpRequest')
-
-        if extraHeaders:
-            for header, headerval in extraHeaders.iteritems():
-                req.add_header(header, headerval)
-
-        log.debug("Getting target '%s' (original: %s)" % (target, url))
-        response = self.opener.open(req, data)
-        log.debug("Getting target '%s' (original: %s)" % (target, url))
+        response = _open(self.opener, url, ajax, data, extraHeaders)
 
         if returnResponse:
             return response
@@ -92,20 +105,65 @@ class HttpClient(object):
 def resolveRedirect(url):
     return get(url, returnResponse=True).url
 
-def get(url, ajax=False, cleanup=False, data=None, returnResponse=False, extraHeaders=None, cookies=None):
+def get(url, ajax=False, cleanup=False, data=None, returnResponse=False, extraHeaders=None, cookies=None,
+        cacheTime=None):
     '''Load a webpage from with an HTTP request like a browser would do
     @param ajax: if True, will add header to identify to server as an XMLHttpRequest (from a browser)
     @param cleanup: if True, data will be cleaned up before returning
     @param data: data to be POSTed on the request
     @param returnResponse: if True, will return the response object before reading instead of data read
     @param cookies: a cookies file to use to store cookies for a request
+    @param cacheTime: if set, the page is loaded through the page cache and kept fresh for this many seconds
+        (ignored for POSTs and when the response is requested)
     @return: the loaded html, or the response if returnResponse was true'''
-    target = getTarget(url)
+    if cacheTime and not data and not returnResponse:
+        return getPage(url, cacheTime, cleanup, ajax, extraHeaders, cookies).html
 
-    cookieJar = None
+    opener = _defaultOpener
+    session = None
     if cookies:
-        cookieJar = setupCookiesForRequest(cookies)
+        session = getCookieSession(cookies)
+        opener = session.opener
+
+    response = _open(opener, url, ajax, data, extraHeaders)
+
+    if session:
+        session.save(ignoreDiscard=True)
+
+    if returnResponse:
+        return response
+
+    html = response.read()
+    response.close()
+
+    if cleanup:
+        html = cleanHtml(html)
+
+    return html
 
+def _open(opener, url, ajax=False, data=None, extraHeaders=None):
+    '''open a request to an url, failing over to the next mirror if the site's mirror fails (@see: getTargets)
+    @return: the response'''
+    urlClass = deadlines.getUrlClass(url, ajax)
+    targets = getTargets(url)
+    for host, target in targets:
+        log.debug("Getting target '%s' (original: %s)", target, url)
+        ratelimit.acquire(target)
+        try:
+            return deadlines.openRequest(opener, lambda target=target: _buildRequest(target, ajax, extraHeaders),
+                                             data, urlClass)
+        except Exception as e:
+            if not host or host == targets[-1][0] or not mirrors.isFailure(e):
+                raise
+            mirrors.reportFailure(host)
+
+
+def _buildRequest(target, ajax=False, extraHeaders=None):
+    '''create a request like a browser would do
+    @param target: the absolute url to request
+    @param ajax: if True, will add header to identify to server as an XMLHttpRequest (from a browser)
+    @param extraHeaders: other headers to add to the request
+    @return: the urllib2.Request'''
     req = urllib2.Request(target)
     req.add_header('Accept', 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8')
     req.add_header('User-Agent', 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/534.30 (KHTML, like Gecko) Ubuntu/11.04 Chromium/12.0.742.112 Chrome/12.0.742.112 Safari/534.30')
@@ -115,49 +173,251 @@ def get(url, ajax=False, cleanup=False, data=None, returnResponse=False, extraHe
     if extraHeaders:
         for header, headerval in extraHeaders.iteritems():
             req.add_header(header, headerval)
+    return req
+
+class Page(object):
+    '''a page loaded through the page cache.
+    The version identifies the contents of the page, so that results parsed from it can be reused while
+    the page does not change. The html is only read from the cache when it is used.'''
+
+    def __init__(self, url, version, html=None, cleanup=False):
+        self.url = url
+        self.version = version
+        self.__html = html
+        self.__cleanup = cleanup
+
+    @property
+    def html(self):
+        if self.__html is None:
+            self.__html = cache.pages.getValue(getCacheKey(self.url))
+            if self.__html is None:
+                # the cached copy is gone (cleaned up by another process?), load it again
+                self.__html = get(self.url)
+        if self.__cleanup:
+            self.__html = cleanHtml(self.__html)
+            self.__cleanup = False
+        return self.__html
+
+    def chunks(self, chunkSize=CHUNK_SIZE):
+        '''read the html of this page in chunks from the page cache, so that it never is all in memory
+        (unless it already was, ie: when there is no storage for the cache)
+        @param chunkSize: the size of the chunks to read
+        @return: a generator of chunks of the html'''
+        chunks = None
+        if self.__html is None:
+            chunks = cache.pages.iterValue(getCacheKey(self.url), chunkSize)
+        if chunks is None:
+            html = self.html
+            return (html[index:index + chunkSize] for index in xrange(0, len(html), chunkSize))
+        if self.__cleanup:
+            return cleanChunks(chunks)
+        return chunks
+
+
+def getPage(url, cacheTime, cleanup=False, ajax=False, extraHeaders=None, cookies=None, stream=False):
+    '''Load a webpage through the page cache.
+    Fresh cached pages are returned without any request. Once a cached page expires, it is revalidated with a
+    conditional request (using the ETag and Last-Modified validators of the cached copy) and if the server
+    answers with '304 Not Modified' the cached copy is kept fresh for another cacheTime seconds.
+
+    Loading a page is a single flight across all plugin instances: while one instance loads a page, other
+    instances wanting the same page wait for it and then use the copy it stored in the cache.
+    @param url: the url of the page to load
+    @param cacheTime: how long, in seconds, the loaded page is fresh
+    @param cleanup: if True, the html will be cleaned up
+    @param stream: if True, the page is written to the cache as it is read, so that it never is all in memory
+        and should be read with Page.chunks()
+    @return: the loaded Page'''
+    key = getCacheKey(url)
+    meta = cache.pages.getMeta(key)
+    if cache.isFresh(meta):
+        log.debug("using cached page for '%s'", key)
+        return Page(url, meta['version'], cleanup=cleanup)
+
+    lock = filelock.FileLock(storage.getPath("locks", hashlib.md5(key).hexdigest() + ".lock"), temporary=True)
+    if not lock.acquire(timeout=SINGLE_FLIGHT_TIMEOUT):
+        log.warning("Timed out waiting for another instance to load '%s', loading it again", key)
+        return _loadPage(url, key, meta, cacheTime, cleanup, ajax, extraHeaders, cookies, stream)
+    try:
+        # another instance may have loaded the page while we waited
+        meta = cache.pages.getMeta(key)
+        if cache.isFresh(meta):
+            log.debug("using page for '%s' loaded by another instance", key)
+            return Page(url, meta['version'], cleanup=cleanup)
+        return _loadPage(url, key, meta, cacheTime, cleanup, ajax, extraHeaders, cookies, stream)
+    finally:
+        lock.release()
+
+
+def _loadPage(url, key, meta, cacheTime, cleanup, ajax, extraHeaders, cookies, stream):
+    '''load a page (revalidating the cached copy if there is one) and store it in the page cache
+    @param key: the key of the page in the page cache (@see: getCacheKey)
+    @param meta: the metadata of the cached copy of the page (if any)
+    @return: the loaded Page'''
+    headers = dict(extraHeaders or {})
+    if meta:
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('lastModified'):
+            headers['If-Modified-Since'] = meta['lastModified']
+
+    try:
+        response = get(url, ajax=ajax, returnResponse=True, extraHeaders=headers, cookies=cookies)
+    except urllib2.HTTPError as e:
+        if e.code == 304 and meta:
+            log.debug("cached page for '%s' was not modified", key)
+            cache.pages.touch(key, cacheTime)
+            return Page(url, meta['version'], cleanup=cleanup)
+        raise
+
+    try:
+        etag = response.info().getheader('ETag')
+        lastModified = response.info().getheader('Last-Modified')
+        if stream:
+            digest = hashlib.md5()
+            read = [False]
+
+            def chunks():
+                for chunk in iter(lambda: response.read(CHUNK_SIZE), ''):
+                    read[0] = True
+                    digest.update(chunk)
+                    yield chunk
+
+            if cache.pages.writeValue(key, chunks()):
+                version = digest.hexdigest()
+                cache.pages.touch(key, cacheTime, version=version, etag=etag, lastModified=lastModified)
+                return Page(url, version, cleanup=cleanup)
+            if read[0]:
+                # what was read of the page is gone, reading the rest would cache a truncated page
+                raise IOError("Failed to cache the page of '%s'" % url)
+        html = response.read()
+    finally:
+        response.close()
 
-    log.debug("Getting target '%s' (original: %s)" % (target, url))
-    response = urllib2.urlopen(req, data)
-    log.debug("Getting target '%s' (original: %s)" % (target, url))
+    version = hashlib.md5(html).hexdigest()
+    if meta and meta.get('version') == version:
+        # same contents, no need to rewrite them
+        cache.pages.touch(key, cacheTime, etag=etag, lastModified=lastModified)
+    else:
+        cache.pages.put(key, html, cacheTime, version=version, etag=etag, lastModified=lastModified)
+    return Page(url, version, html, cleanup)
 
-    if cookieJar:
-        cookieJar.save(cookies, ignore_discard=True)
 
-    if returnResponse:
-        return response
+class CookieSession(object):
+    '''the cookies of a cookies file, shared by every request (and HttpClient) that uses that file.
+    The file is loaded once per process and only written back when the cookies change. Writes are atomic
+    and done under a lock, merging the cookies other plugin instances may have saved in the meantime.'''
 
-    html = response.read()
-    response.close()
+    LOCK_TIMEOUT = 10
 
-    if cleanup:
-        html = cleanHtml(html)
+    def __init__(self, cookiesFile):
+        '''create a session, loading the cookies in a file
+        @param cookiesFile: the file with the cookies of this session'''
+        import cookielib
+
+        self.file = cookiesFile
+        self.cookieJar = cookielib.LWPCookieJar()
+        self.opener = deadlines.buildOpener(urllib2.HTTPCookieProcessor(self.cookieJar))
+        self.__lock = threading.Lock()
+        if os.path.isfile(cookiesFile):
+            log.debug("loading cookies from file '%s'", cookiesFile)
+            self.cookieJar.load(cookiesFile)
+        self.__saved = self.__state()
+
+    def __state(self):
+        return set([(c.domain, c.path, c.name, c.value, c.expires, c.discard) for c in self.cookieJar])
+
+    def save(self, ignoreDiscard=True):
+        '''save the cookies of this session to its file, if they changed
+        @param ignoreDiscard: if cookies marked to be discarded should still be saved'''
+        import cookielib
+
+        self.__lock.acquire()
+        try:
+            state = self.__state()
+            if state == self.__saved:
+                return
+            try:
+                lock = filelock.FileLock(self.file + ".lock", self.LOCK_TIMEOUT)
+                with lock:
+                    merged = cookielib.LWPCookieJar()
+                    if os.path.isfile(self.file):
+                        merged.load(self.file, ignore_discard=True)
+                    for cookie in self.cookieJar:
+                        merged.set_cookie(cookie)
+                    storage.writeAtomically(self.file, "#LWP-Cookies-2.0\n" +
+                                                       merged.as_lwp_str(ignore_discard=ignoreDiscard))
+                self.__saved = state
+                log.debug("saved cookies to file '%s'", self.file)
+            except filelock.LockTimeout:
+                log.warning("Could not lock cookies file '%s', cookies not saved", self.file)
+        finally:
+            self.__lock.release()
+
+
+__sessions = {}
+__sessionsLock = threading.Lock()
+
+
+def getCookieSession(cookiesFile):
+    '''get the cookie session for a cookies file, loading it if this is the first time it is used
+    @param cookiesFile: the file with the cookies
+    @return: the CookieSession for that file'''
+    __sessionsLock.acquire()
+    try:
+        if cookiesFile not in __sessions:
+            __sessions[cookiesFile] = CookieSession(cookiesFile)
+        return __sessions[cookiesFile]
+    finally:
+        __sessionsLock.release()
 
-    return html
 
 def setupCookiesForRequest(cookiesFile):
-    '''creates a cookie jar, loads the cookies from a file and sets up the urllib2 opener
+    '''get the cookie jar for a cookies file (@see: getCookieSession)
     @param cookiesFile: the file with cookies to load
     @return: the cookie jar loaded'''
-    import cookielib, os
-
-    cookieJar = cookielib.LWPCookieJar()
-    if os.path.isfile(cookiesFile):
-        log.debug("loading cookies from file '%s'" % cookiesFile)
-        cookieJar.load(cookiesFile)
-
-    opener = urllib2.build_opener(urllib2.HTTPCookieProcessor(cookieJar))
-    urllib2.install_opener(opener)
-
-    log.debug("installed http cookie handler for cookie jar '%s'" % str(cookieJar))
-
-    return cookieJar
-
+    return getCookieSession(cookiesFile).cookieJar
+
+
+def getTargets(url):
+    '''get the absolute urls to try, in order, to request an url
+    @param url: the url, relative to the site or absolute
+    @return: a list of (mirror host, absolute url) for urls of the site (one for each mirror, best first),
+        or just [(None, url)] for other urls'''
+    if mirrors.isSite(url):
+        path = mirrors.relativize(url)
+        return [(host, host + path) for host in mirrors.getRanking()]
+    return [(None, url)]
+
+
+def getCacheKey(url):
+    '''get the key to cache what is loaded from an url with, the same for every mirror of the site
+    @param url: the url, relative to the site or absolute
+    @return: the cache key'''
+    return mirrors.relativize(url)
+
+
+def cleanChunks(chunks, maxWindow=MAX_CLEANUP_WINDOW):
+    '''Cleanup html read in chunks (@see: cleanHtml), keeping only a small window of it in memory.
+    The cleanup never spans lines, so chunks are cleaned up to their last line break and the rest waits for the
+    next chunk. Lines longer than the window are cut before their last entity.
+    @param chunks: an iterable of chunks of the original html
+    @param maxWindow: the most html to keep waiting for a line break
+    @return: a generator of chunks of the cleaned up html'''
+    pending = ""
+    for chunk in chunks:
+        pending += chunk
+        cut = pending.rfind('\n') + 1
+        if not cut and len(pending) > maxWindow:
+            cut = pending.rfind('&')
+            if cut <= 0:
+                cut = len(pending)
+        if cut:
+            yield cleanHtml(pending[:cut])
+            pending = pending[cut:]
+    if pending:
+        yield cleanHtml(pending)
 
-def getTarget(url):
-    target = url
-    if url.find('http://') < 0:
-        target = "http://www.primewire.ag" + url
-    return target
 
 def cleanHtml(html):
     '''Cleanup html by unescaping common html
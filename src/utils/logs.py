@@ -0,0 +1,77 @@
+# -*- coding: UTF-8 -*-
+'''
+Loggers for the plugin's hot paths (ie: code that runs for every item of a listing).
+
+Most loggers are configured above DEBUG (@see: resources/logging.conf), yet messages built with the % operator
+are formatted, and their arguments converted to strings, on every call. The loggers made here (@see: getLogger)
+take the message's arguments instead, so that it is only formatted when a record is emitted, and their methods
+for the levels that are disabled do nothing at all, without even checking the level.
+
+Levels are only known once logging is configured, which is after most modules made their loggers, so
+plugin.initialize calls configure to bind the methods of every logger made here again.
+
+Created on Oct 19, 2026
+
+@author: pguedes
+'''
+import logging, threading
+
+"""the levels that are bound to a method that does nothing when they are disabled"""
+LEVELS = ((logging.DEBUG, 'debug'), (logging.INFO, 'info'), (logging.WARNING, 'warning'),
+          (logging.ERROR, 'error'), (logging.ERROR, 'exception'), (logging.CRITICAL, 'critical'))
+
+_loggers = {}
+_loggersLock = threading.Lock()
+
+
+class Logger(object):
+    '''a logger that formats its messages lazily and ignores the calls for disabled levels
+    Messages are given with their arguments, like: log.debug("loaded %s in %.2fs", url, elapsed)'''
+
+    def __init__(self, name):
+        self.name = name
+        self.logger = logging.getLogger(name)
+        self.bind()
+
+    def bind(self):
+        '''bind the logging methods to the ones of the logger, or to nothing for the levels that are disabled'''
+        for level, method in LEVELS:
+            if self.logger.isEnabledFor(level):
+                setattr(self, method, getattr(self.logger, method))
+            else:
+                setattr(self, method, _ignore)
+        self.warn = self.warning
+
+    def isEnabledFor(self, level):
+        '''check if a level is enabled, to skip computing arguments that are expensive to get
+        @param level: the logging level
+        @return: true if messages of that level are emitted'''
+        return self.logger.isEnabledFor(level)
+
+
+def _ignore(message, *args, **kwargs):
+    pass
+
+
+def getLogger(name):
+    '''get a logger
+    @param name: the name of the logger (as configured in resources/logging.conf)
+    @return: the Logger'''
+    _loggersLock.acquire()
+    try:
+        logger = _loggers.get(name)
+        if logger is None:
+            logger = _loggers[name] = Logger(name)
+        return logger
+    finally:
+        _loggersLock.release()
+
+
+def configure():
+    '''bind the methods of the loggers to the levels logging was configured with'''
+    _loggersLock.acquire()
+    try:
+        for logger in _loggers.values():
+            logger.bind()
+    finally:
+        _loggersLock.release()
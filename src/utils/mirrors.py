@@ -0,0 +1,212 @@
+# -*- coding: UTF-8 -*-
+'''
+Mirrors of the site the plugin harvests.
+
+The site is reachable on several hosts (mirrors) serving the same pages. Urls of the site are kept relative
+to the host (ie: '/index.php?tv=') in the plugin's items, so they stay valid whatever mirror is used, and
+htmlutils rewrites them to the best mirror when requesting them (@see: htmlutils.getTargets).
+
+Mirrors are ranked by probing their latency, all at the same time, and the ranking is kept in the profile
+directory for RANKING_TIME seconds, shared by every plugin instance. A mirror that fails during a request
+is reported (@see: reportFailure) and moved behind the healthy ones until the next probe, and the request
+is retried on the next mirror (failover).
+
+Created on Oct 19, 2026
+
+@author: pguedes
+'''
+import cPickle, httplib, os, socket, time, urllib2
+from utils import filelock, logs, pipeline, storage
+
+log = logs.getLogger("mirrors")
+
+"""the mirrors used when none are configured, the first one is the site's main host"""
+DEFAULT_HOSTS = ["http://www.primewire.ag"]
+
+"""the page requested to probe a mirror"""
+PROBE_PATH = "/"
+PROBE_TIMEOUT = 3
+"""how long, in seconds, the ranking of the mirrors is kept before probing them again"""
+RANKING_TIME = 6 * 60 * 60
+"""how long, in seconds, a mirror that failed is kept behind the healthy ones"""
+FAILURE_TIME = 10 * 60
+
+LOCK_TIMEOUT = PROBE_TIMEOUT * 2
+
+_hosts = list(DEFAULT_HOSTS)
+_state = None
+
+
+def setHosts(hosts):
+    '''configure the mirrors of the site
+    @param hosts: the list of mirror hosts (ie: 'http://www.primewire.ag'), the defaults are used if empty'''
+    global _hosts, _state
+    hosts = [_normalize(host) for host in hosts if host.strip()] or list(DEFAULT_HOSTS)
+    if hosts != _hosts:
+        log.debug("using mirrors %r", hosts)
+        _hosts = hosts
+        _state = None
+
+
+def getHosts():
+    '''get the configured mirrors of the site
+    @return: the list of mirror hosts'''
+    return list(_hosts)
+
+
+def _normalize(host):
+    host = host.strip().rstrip('/')
+    if host.find('://') < 0:
+        host = 'http://' + host
+    return host
+
+
+def _findHost(url):
+    for host in _hosts + DEFAULT_HOSTS:
+        if url == host or url.startswith(host + '/') or url.startswith(host + '?'):
+            return host
+    return None
+
+
+def isSite(url):
+    '''check if an url is of the site (relative or on one of its mirrors)
+    @param url: the url to check
+    @return: true if the url is of the site'''
+    return url.find('://') < 0 or _findHost(url) is not None
+
+
+def relativize(url):
+    '''get an url of the site relative to its host, so it is valid on every mirror
+    @param url: the url, relative or on one of the mirrors (other urls are returned unchanged)
+    @return: the url relative to the host'''
+    host = _findHost(url)
+    if host:
+        url = url[len(host):]
+    if url.find('://') < 0 and not url.startswith('/'):
+        url = '/' + url
+    return url
+
+
+def getRanking():
+    '''get the mirrors to use, best first, probing them if their ranking expired
+    @return: the list of mirror hosts, healthy ones first by latency and then the ones that failed'''
+    if len(_hosts) == 1:
+        return list(_hosts)
+    state = _loadState()
+    if not _isCurrent(state):
+        state = _rank()
+    now = time.time()
+    healthy = [host for host in state['ranking'] if state['failed'].get(host, 0) <= now]
+    failed = [host for host in state['ranking'] if state['failed'].get(host, 0) > now]
+    return healthy + failed
+
+
+def reportFailure(host):
+    '''report that a mirror failed to answer, moving it behind the healthy mirrors for a while
+    @param host: the host of the mirror'''
+    log.warning("Mirror '%s' failed, using the next one for %ds", host, FAILURE_TIME)
+    _updateState(lambda state: state['failed'].__setitem__(host, time.time() + FAILURE_TIME))
+
+
+def isFailure(error):
+    '''check if an error of a request means the mirror is unavailable (and the request should fail over)
+    @param error: the error raised by the request
+    @return: true if the request should be retried on another mirror'''
+    if isinstance(error, urllib2.HTTPError):
+        return error.code >= 500
+    return isinstance(error, (urllib2.URLError, socket.error, httplib.HTTPException))
+
+
+def _isCurrent(state):
+    return state is not None and state['hosts'] == _hosts and state['time'] + RANKING_TIME > time.time()
+
+
+def _probe(host):
+    '''request a mirror's probe page
+    @return: the latency of the mirror, or None if it is not healthy'''
+    start = time.time()
+    try:
+        response = urllib2.urlopen(host + PROBE_PATH, timeout=PROBE_TIMEOUT)
+        try:
+            response.read(1024)
+        finally:
+            response.close()
+    except (urllib2.URLError, socket.error, httplib.HTTPException) as e:
+        log.warning("Mirror '%s' is not healthy: %s", host, e)
+        return None
+    return time.time() - start
+
+
+def _rank():
+    '''probe the mirrors (unless another instance just did) and save their ranking
+    @return: the new state'''
+    path = _getStatePath()
+    try:
+        with filelock.FileLock(path and path + ".lock", LOCK_TIMEOUT):
+            state = _readState(path)
+            if _isCurrent(state):
+                return _setState(state)
+            hosts = list(_hosts)
+            # all the mirrors are probed at the same time
+            latencies = list(pipeline.Pipeline([pipeline.Stage("probe", _probe, len(hosts))]).run(hosts))
+            now = time.time()
+            probes = sorted(zip(hosts, latencies), key=lambda probe: (probe[1] is None, probe[1]))
+            ranking = [host for host, latency in probes]
+            failed = dict([(host, now + FAILURE_TIME) for host, latency in zip(hosts, latencies) if latency is None])
+            state = {'time': now, 'hosts': hosts, 'ranking': ranking, 'failed': failed}
+            log.debug("ranked mirrors: %r (latencies: %r)", ranking, latencies)
+            _writeState(path, state)
+            return _setState(state)
+    except filelock.LockTimeout:
+        log.warning("Timed out waiting for another instance to rank the mirrors")
+        # keep the configured order in this instance, the other one will save its ranking
+        return _setState({'time': time.time(), 'hosts': list(_hosts), 'ranking': list(_hosts), 'failed': {}})
+
+
+def _updateState(update):
+    path = _getStatePath()
+    try:
+        with filelock.FileLock(path and path + ".lock", LOCK_TIMEOUT):
+            state = _readState(path) or _state
+            if state is None or state['hosts'] != _hosts:
+                return
+            update(state)
+            _writeState(path, state)
+            _setState(state)
+    except (filelock.LockTimeout, IOError, OSError):
+        log.exception("Failed to save the ranking of the mirrors")
+
+
+def _getStatePath():
+    return storage.getPath("mirrors.pickle")
+
+
+def _loadState():
+    if _state is None:
+        _setState(_readState(_getStatePath()))
+    return _state
+
+
+def _setState(state):
+    global _state
+    _state = state
+    return state
+
+
+def _readState(path):
+    if not path or not os.path.isfile(path):
+        return None
+    try:
+        stateFile = open(path, 'rb')
+        try:
+            return cPickle.load(stateFile)
+        finally:
+            stateFile.close()
+    except (IOError, EOFError, cPickle.UnpicklingError):
+        log.exception("Failed to read the ranking of the mirrors from '%s'", path)
+        return None
+
+
+def _writeState(path, state):
+    if path:
+        storage.writeAtomically(path, cPickle.dumps(state, cPickle.HIGHEST_PROTOCOL))
@@ -0,0 +1,276 @@
+# -*- coding: UTF-8 -*-
+'''
+Staged pipelines: work split in stages (ie: fetch pages, extract items, load their metadata), where each stage
+runs on its own threads, with its own concurrency limit, and items move on to the next stage as soon as they
+are done. Loading a listing this way overlaps the network, the parsing and the metadata lookups instead of
+doing them one after another.
+
+Python 2 has no asyncio, so stages run on threads and talk through queues. The caller's thread drives the
+pipeline by iterating its results (@see: Pipeline.run), which come out in the order of the inputs they were
+produced from, as soon as they (and the ones before them) are ready.
+
+A stage's threads only live while the pipeline runs, unless the stage runs on a WorkerPool: threads that live
+as long as the process, for work that needs state that is expensive to set up for each thread (ie: a database
+connection, which can only be used by the thread that made it).
+
+Created on Oct 19, 2026
+
+@author: pguedes
+'''
+import sys, threading, Queue
+from utils import logs
+
+log = logs.getLogger("pipeline")
+
+_STOP = object()
+
+
+class Stage(object):
+    '''a stage of a pipeline'''
+
+    def __init__(self, name, function, workers=1, expand=False, pool=None):
+        '''create a stage
+        @param name: the name of the stage (for logging)
+        @param function: the function applied to each item that reaches this stage
+        @param workers: how many items this stage works on at the same time
+        @param expand: if the function returns an iterable of items (possibly empty), each moving on by itself,
+            instead of a single item
+        @param pool: the WorkerPool to run this stage on, instead of its own threads (workers is ignored then)'''
+        self.name = name
+        self.function = function
+        self.workers = workers
+        self.expand = expand
+        self.pool = pool
+
+
+class WorkerPool(object):
+    '''threads that live as long as the process, started when they are first needed'''
+
+    def __init__(self, name, workers, initialize=None):
+        '''create a pool
+        @param name: the name of the pool (for its threads)
+        @param workers: how many threads the pool has
+        @param initialize: a function each thread calls once, when it starts (ie: to set up thread local state)'''
+        self.name = name
+        self.workers = workers
+        self.initialize = initialize
+        self.__queue = Queue.Queue()
+        self.__threads = []
+        self.__lock = threading.Lock()
+        self.__local = threading.local()
+
+    def submit(self, function, *args):
+        '''run a function on one of the pool's threads
+        @param function: the function to run
+        @param args: the arguments to call it with'''
+        self.__start()
+        self.__queue.put((function, args))
+
+    def call(self, function, *args):
+        '''run a function on one of the pool's threads (on the current one if it is one of them) and wait for it
+        @param function: the function to run
+        @param args: the arguments to call it with
+        @return: what the function returned
+        @raise Exception: the exception raised by the function'''
+        if self.isWorker():
+            return function(*args)
+        answer = Queue.Queue()
+
+        def run():
+            try:
+                answer.put((function(*args), None))
+            except:
+                answer.put((None, sys.exc_info()[1]))
+        self.submit(run)
+        value, error = answer.get()
+        if error is not None:
+            raise error
+        return value
+
+    def isWorker(self):
+        '''check if the current thread is one of the pool's threads'''
+        return getattr(self.__local, 'worker', False)
+
+    def __start(self):
+        self.__lock.acquire()
+        try:
+            while len(self.__threads) < self.workers:
+                worker = threading.Thread(target=self.__work, name="%s-%d" % (self.name, len(self.__threads)))
+                worker.setDaemon(True)
+                worker.start()
+                self.__threads.append(worker)
+        finally:
+            self.__lock.release()
+
+    def __work(self):
+        self.__local.worker = True
+        if self.initialize:
+            try:
+                self.initialize()
+            except:
+                log.exception("Failed to initialize a thread of pool '%s'", self.name)
+        while True:
+            function, args = self.__queue.get()
+            try:
+                function(*args)
+            except:
+                log.exception("Failed to run work on pool '%s'", self.name)
+
+
+class Pipeline(object):
+    '''a sequence of stages that items go through'''
+
+    def __init__(self, stages):
+        '''create a pipeline
+        @param stages: the list of Stages, in order'''
+        self.stages = stages
+
+    def run(self, inputs):
+        '''run items through the pipeline
+        @param inputs: the items for the first stage
+        @return: a generator of the items out of the last stage, in order
+        @raise Exception: the exception raised by a stage on an item, when that item's turn to come out comes'''
+        inputs = list(inputs)
+        results = _OrderedResults(len(inputs))
+        queues = [Queue.Queue() for stage in self.stages]
+        workers = []
+        # stages run on pools are given their input by submitting it to the pool, so go from the last one
+        for index in reversed(range(len(self.stages))):
+            stage = self.stages[index]
+            output = index + 1 < len(queues) and queues[index + 1] or None
+            if stage.pool:
+                queues[index] = _PoolInput(stage, output, results)
+                continue
+            for number in range(stage.workers):
+                worker = threading.Thread(target=_work, args=(stage, queues[index], output, results),
+                                          name="%s-%d" % (stage.name, number))
+                worker.setDaemon(True)
+                worker.start()
+                workers.append((queues[index], worker))
+
+        for position, item in enumerate(inputs):
+            queues[0].put(((position,), item))
+        try:
+            for item in results:
+                yield item
+        finally:
+            for queue, worker in workers:
+                queue.put(_STOP)
+            for queue, worker in workers:
+                worker.join()
+
+
+class _PoolInput(object):
+    '''the input of a stage that runs on a WorkerPool: items put in it are submitted to the pool'''
+
+    def __init__(self, stage, output, results):
+        self.stage = stage
+        self.output = output
+        self.results = results
+
+    def put(self, work):
+        if work is not _STOP:
+            self.stage.pool.submit(_process, self.stage, work, self.output, self.results)
+
+
+def _work(stage, input, output, results):
+    while True:
+        work = input.get()
+        if work is _STOP:
+            return
+        _process(stage, work, output, results)
+
+
+def _process(stage, work, output, results):
+    key, item = work
+    try:
+        value = stage.function(item)
+        if stage.expand:
+            values = list(value)
+            results.expanded(key, len(values))
+            produced = [(key + (position,), value) for position, value in enumerate(values)]
+        else:
+            produced = [(key, value)]
+    except:
+        log.debug("stage '%s' failed on %r", stage.name, item)
+        results.failed(key, sys.exc_info()[1])
+        return
+    for work in produced:
+        if output:
+            output.put(work)
+        else:
+            results.done(*work)
+
+
+class _OrderedResults(object):
+    '''the results of a pipeline, handed out in the order of their keys.
+    Keys are tuples: inputs have keys (0,), (1,), ... and the items an expanding stage makes of the item with key
+    k have keys k + (0,), k + (1,), ... so results come out depth first, as if every stage ran in order.'''
+
+    def __init__(self, inputs):
+        self.__condition = threading.Condition()
+        self.__ready = {}
+        self.__errors = {}
+        self.__children = {(): inputs}
+        self.__cursor = [0]
+
+    def done(self, key, value):
+        self.__set(self.__ready, key, value)
+
+    def failed(self, key, error):
+        self.__set(self.__errors, key, error)
+
+    def expanded(self, key, count):
+        self.__set(self.__children, key, count)
+
+    def __set(self, values, key, value):
+        self.__condition.acquire()
+        try:
+            values[key] = value
+            self.__condition.notify()
+        finally:
+            self.__condition.release()
+
+    def __iter__(self):
+        while True:
+            self.__condition.acquire()
+            try:
+                key = self.__advance()
+                while key is not None and key not in self.__ready and key not in self.__errors:
+                    self.__condition.wait(1)
+                    key = self.__advance()
+                if key is None:
+                    return
+                value = self.__ready.pop(key, None)
+                error = self.__errors.pop(key, None)
+            finally:
+                self.__condition.release()
+            self.__next()
+            if error is not None:
+                raise error
+            yield value
+
+    def __advance(self):
+        '''move the cursor past finished branches and into expanded items
+        @return: the key of the next result, or None when there are no more results'''
+        while True:
+            cursor = tuple(self.__cursor)
+            if not cursor:
+                return None
+            if self.__cursor[-1] >= self.__children[cursor[:-1]]:
+                # past the last item of this branch, continue after its parent
+                self.__cursor.pop()
+                if self.__cursor:
+                    self.__cursor[-1] += 1
+                continue
+            if cursor in self.__children and cursor not in self.__errors:
+                self.__cursor.append(0)
+                continue
+            return cursor
+
+    def __next(self):
+        self.__condition.acquire()
+        try:
+            self.__cursor[-1] += 1
+        finally:
+            self.__condition.release()
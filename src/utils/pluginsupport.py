@@ -4,14 +4,25 @@ Created  on  Jan  24,  2010
 
 @author:  pguedes
 '''
-from  utils import notification
+from  utils import background, logs, notification, pipeline
 import xbmc, xbmcplugin, xbmcgui  #@UnresolvedImport
-import urllib, os, sys, logging
+import urllib, os, sys, threading
 
-log = logging.getLogger("pluginsupport")
+log = logs.getLogger("pluginsupport")
 
 CACHE_PATH_FORMAT = "special://masterprofile/Thumbnails/Video/%s/%s"
 
+"""how many parts of a video are resolved at the same time while the first one plays"""
+PART_WORKERS = 2
+"""how many times resolving a part (or adding it to the playlist) is tried, and the delay, in seconds, before
+retrying (multiplied by the number of the attempt)"""
+PART_ATTEMPTS = 3
+PART_RETRY_DELAY = 2
+
+# the invocation arguments, and output, of the threads that work for an invocation other than the process' own
+# (ie: in the resident service, or after the invocation returned, @see: setInvocation, _getArgv)
+_invocation = threading.local()
+
 
 def _preChacheThumbnail(url, reason="May  take  a  while..."):
     '''Cache  an  image  file  (cover  or  backdrop)
@@ -22,22 +33,22 @@ def _preChacheThumbnail(url, reason="May  take  a  while..."):
     try:
         filename = xbmc.getCacheThumbName(url)
         filepath = CACHE_PATH_FORMAT % (filename[0], filename)
-        log.debug("Got thumbnail path '%s' for file '%s'" % (filename, url))
+        log.debug("Got thumbnail path '%s' for file '%s'", filename, url)
         if not os.path.isfile(filepath):
             notifier = notification.getUserNotifier("Downloading  artwork", reason)
-            log.debug("Caching  thumbnail  '%s'  for  remote  file  '%s'" % (filename, url))
+            log.debug("Caching  thumbnail  '%s'  for  remote  file  '%s'", filename, url)
             urllib.urlretrieve(url, filepath)
             urllib.urlcleanup()
             notifier.close()
-        log.debug("Returning  thumb  '%s'  for  file  '%s'" % (filename, url))
+        log.debug("Returning  thumb  '%s'  for  file  '%s'", filename, url)
         return filepath
     except:
-        log.exception("Failed  to  cache  thumbnail:  %s" % url)
+        log.exception("Failed  to  cache  thumbnail:  %s", url)
         return url
 
 
 def select(title, items):
-    log.debug("showing options to user: '%s'" % str(items))
+    log.debug("showing options to user: '%s'", items)
     return xbmcgui.Dialog().select(title, items)
 
 
@@ -45,53 +56,181 @@ def showError(e, errorMessage='An  error  occurred!'):
     xbmcgui.Dialog().ok('Error', errorMessage, str(e))
 
 
+def createListItem(spec):
+    """Create a list item for XBMC from its description
+    @param spec: a dict describing the list item (@see: plugin.PluginMovieItem.getListItemSpec)
+    @return: the xbmcgui.ListItem"""
+    listItem = xbmcgui.ListItem(spec['label'], iconImage=spec['thumb'], thumbnailImage=spec['thumb'],
+                                path=spec['path'])
+    listItem.setInfo(type="Video", infoLabels=spec['info'])
+    for name, value in spec['properties'].iteritems():
+        listItem.setProperty(name, value)
+    if spec['contextMenu']:
+        listItem.addContextMenuItems(spec['contextMenu'])
+    return listItem
+
+
+class DirectoryOutput(object):
+    """Sends the results of the plugin's invocation to XBMC, using the plugin handle of the invocation"""
+
+    def addDirectoryItem(self, url, spec, isFolder, count):
+        xbmcplugin.addDirectoryItem(int(sys.argv[1]), url, createListItem(spec), isFolder, count)
+
+    def setContent(self, contentType):
+        xbmcplugin.setContent(int(sys.argv[1]), contentType)
+
+    def setResolvedUrl(self, spec):
+        xbmcplugin.setResolvedUrl(int(sys.argv[1]), True, createListItem(spec))
+
+    def endOfDirectory(self, success):
+        xbmcplugin.endOfDirectory(int(sys.argv[1]), success)
+
+
+class RecordingOutput(object):
+    """Records the results of the plugin's invocation so that they can be sent to XBMC by another process
+    (@see: replay)"""
+
+    def __init__(self):
+        self.calls = []
+
+    def addDirectoryItem(self, url, spec, isFolder, count):
+        self.calls.append(('addDirectoryItem', (url, spec, isFolder, count)))
+
+    def setContent(self, contentType):
+        self.calls.append(('setContent', (contentType,)))
+
+    def setResolvedUrl(self, spec):
+        self.calls.append(('setResolvedUrl', (spec,)))
+
+    def endOfDirectory(self, success):
+        self.calls.append(('endOfDirectory', (success,)))
+
+
+_output = DirectoryOutput()
+
+
+def setInvocation(argv, output=None):
+    """Set the invocation the current thread handles, instead of the process' own (sys.argv), so that several
+    invocations can be handled at the same time (@see: utils.service)
+    @param argv: the invocation arguments (<base url>, <handle>, <query string>), None for the process' own
+    @param output: where the results of the invocation are sent to (a DirectoryOutput or RecordingOutput), None
+        to send them to XBMC
+    @return: the (argv, output) of the invocation the thread handled before"""
+    previous = (getattr(_invocation, 'argv', None), getattr(_invocation, 'output', None))
+    _invocation.argv = argv
+    _invocation.output = output
+    return previous
+
+
+def bindInvocation(function):
+    """Bind a function to the invocation the current thread handles, for other threads to call it
+    (ie: the stages of a pipeline)
+    @param function: the function to bind
+    @return: a function that calls the function as the current thread's invocation"""
+    argv = _getArgv()
+
+    def bound(*args, **kwargs):
+        previous = getattr(_invocation, 'argv', None)
+        _invocation.argv = argv
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _invocation.argv = previous
+    return bound
+
+
+def _getOutput():
+    return getattr(_invocation, 'output', None) or _output
+
+
+def replay(calls):
+    """Send results recorded by a RecordingOutput to XBMC
+    @param calls: the recorded calls"""
+    output = DirectoryOutput()
+    for name, args in calls:
+        getattr(output, name)(*args)
+
+
 def list(result, contentType=None):
     """List some PluginMovieItems in XBMC
     @param listItems: an iterable of PluginMovieItem instances"""
-    count = result.size
     items = callable(result.items) and result.items() or result.items
     for item in items:
         targetUrl = item.getTargetUrl()
-        listItem = item.getListItem()
-        xbmcplugin.addDirectoryItem(int(sys.argv[1]), targetUrl, listItem, not item.isPlayable(), count)
+        # the size of a StagedResult grows as its items are made
+        _getOutput().addDirectoryItem(targetUrl, item.getListItemSpec(), not item.isPlayable(), result.size)
     if contentType:
-        log.warn("Setting content type: " + str(contentType))
-        xbmcplugin.setContent(int(sys.argv[1]), contentType)
+        log.debug("Setting content type: %s", contentType)
+        _getOutput().setContent(contentType)
 
 
 def play(playableItems):
+    """Play some PluginMovieItems in XBMC: the first one right away and the others (parts) after it.
+    The other parts are resolved in the background, PART_WORKERS at a time, and added to the playlist in order
+    as they are ready, so the player gets the first part without waiting for them (@see: _queueParts)
+    @param playableItems: the list of PluginMovieItems to play"""
     if playableItems and len(playableItems) > 1:
-        playlist = xbmc.PlayList(xbmc.PLAYLIST_VIDEO)
-        #  we  need  to  append  the  parts  to  the  playlist
-        log.debug("Playing  items:  %s" % str(playableItems))
-        position = playlist.getposition()
-        otherParts = playableItems[1:]
+        log.debug("Playing  items:  %s", playableItems)
+        position = xbmc.PlayList(xbmc.PLAYLIST_VIDEO).getposition()
+        # the parts are resolved after this invocation returns
+        background.submit("playlist", _queueParts, playableItems[1:], position, _getArgv()[:])
+
+    log.debug("setting  resolved  url:  %s", playableItems[0].getTargetUrl())
+    _getOutput().setResolvedUrl(playableItems[0].getListItemSpec())
+
+
+def _queueParts(cancelled, otherParts, position, argv):
+    """Resolve the parts of a video and add them to the playlist (a background task)
+    @param cancelled: the event set when this task is cancelled
+    @param otherParts: the PluginMovieItems of the parts after the first one
+    @param position: the position of the first part in the playlist
+    @param argv: the arguments of the invocation that played the video"""
+    playlist = xbmc.PlayList(xbmc.PLAYLIST_VIDEO)
+
+    def resolve(playable):
+        _invocation.argv = argv
+        return _retry(cancelled, lambda: (playable.getTargetUrl(), playable.getListItem()))
+
+    parts = pipeline.Pipeline([pipeline.Stage("parts", resolve, PART_WORKERS)]).run(otherParts)
+    for index, part in enumerate(parts):
+        if cancelled.isSet():
+            return
+        partNumber = index + 2
+        if part is None:
+            log.error("Failed  resolving  part  %s,  it  will  not  be  played", partNumber)
+            continue
+        targetUrl, listItem = part
+        log.debug("Appending  part  %s:  %s  %s", partNumber, targetUrl, position + partNumber)
+        if _retry(cancelled, lambda: playlist.add(targetUrl, listItem, position + partNumber) or True):
+            log.debug("Appended  part  %s:  %s", partNumber, targetUrl)
+        else:
+            log.error("Failed  adding  part  %s  to  playlist", partNumber)
+
+
+def _retry(cancelled, function):
+    """Call a function until it succeeds, up to PART_ATTEMPTS times
+    @param cancelled: the event set when the task calling it is cancelled
+    @return: the result of the function, or None if it kept failing"""
+    for attempt in range(1, PART_ATTEMPTS + 1):
         try:
-            for index in range(len(otherParts)):
-                playable = otherParts[index]
-                partNumber = index + 2
-                log.debug("Appending  part  %s:  %s  %s" % (
-                    str(partNumber), playable.getTargetUrl(), str(position + partNumber)))
-                playlist.add(playable.getTargetUrl(), playable.getListItem(), position + partNumber)
-                log.debug("Appended  part  %s:  %s" % (str(partNumber), playable.getTargetUrl()))
+            return function()
         except:
-            log.exception("Failed  adding  items  to  playlist")
-
-    log.debug("setting  resolved  url:  %s" % playableItems[0].getTargetUrl())
-    xbmcplugin.setResolvedUrl(int(sys.argv[1]), True, playableItems[0].getListItem())
+            log.exception("Attempt  %d  of  %d  failed", attempt, PART_ATTEMPTS)
+        if attempt == PART_ATTEMPTS or background.sleep(cancelled, PART_RETRY_DELAY * attempt):
+            return None
 
 
 def done(success=True):
-    xbmcplugin.endOfDirectory(int(sys.argv[1]), success)
+    _getOutput().endOfDirectory(success)
 
 
 def getArguments():
     '''Parse  the  URL  arguments  into  a  map
     @return:  a  dict  with  the  arguments'''
     param = {}
-    paramstring = sys.argv[2]
+    paramstring = _getArgv()[2]
     if len(paramstring) >= 2:
-        params = sys.argv[2]
+        params = paramstring
         cleanedparams = params.replace('?', '')
         if (params[len(params) - 1] == '/'):
             params = params[0:len(params) - 2]
@@ -103,6 +242,13 @@ def getArguments():
     return param
 
 
+def getInvocationUrl():
+    '''Get  the  plugin  url  XBMC  invoked  (the  path  of  the  folder  being  listed)
+    @return:  the  invoked  url  (<base>?<arg1=arg1Val>&...)'''
+    argv = _getArgv()
+    return argv[0] + argv[2]
+
+
 def encodeArgs(paramMap):
     '''Encode  a  list  of  params  into  a  post string
     @param  paramMap:  map  of  params  to  encode  into  post string
@@ -123,4 +269,11 @@ def encode(paramMap):
     '''Encode  a  list  of  params  into  a  url
     @param  paramMap:  map  of  params  to  encode  into  url
     @return:  encoded  url  (<base>?<arg1=arg1Val>&...)'''
-    return sys.argv[0] + "?" + encodeArgs(paramMap)
+    return _getArgv()[0] + "?" + encodeArgs(paramMap)
+
+
+def _getArgv():
+    '''get the arguments of the invocation the current thread works for: sys.argv, unless the thread works for
+    another invocation (@see: setInvocation) or for one that may have returned already (@see: _queueParts)
+    @return: the invocation arguments (<base url>, <handle>, <query string>)'''
+    return getattr(_invocation, 'argv', None) or sys.argv
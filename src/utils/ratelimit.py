@@ -0,0 +1,154 @@
+# -*- coding: UTF-8 -*-
+'''
+Rate limiting of the plugin's requests, per host.
+
+Bursts of requests (parallel listing pages, background refreshes, cache warming, prefetching) get the plugin
+throttled or shown CAPTCHAs, which costs much more than waiting a little. Every request takes a token from
+its host's bucket first (@see: acquire): buckets refill at a steady rate up to a burst size, and requests wait
+when their host's bucket is empty.
+
+Buckets are kept in the profile directory, under a lock, so they are shared by every plugin instance and the
+service. Background tasks give way to the user's requests: they cannot take the last BACKGROUND_RESERVE tokens
+of a bucket, which are kept for the requests of the user's clicks.
+
+How long requests waited is counted per host and priority (@see: getStats).
+
+Created on Oct 19, 2026
+
+@author: pguedes
+'''
+import cPickle, hashlib, os, threading, time, urlparse
+from utils import background, filelock, logs, mirrors, storage
+
+log = logs.getLogger("ratelimit")
+
+FOREGROUND, BACKGROUND = 'foreground', 'background'
+
+"""the (tokens per second, burst size) of the buckets of the site's mirrors and of other hosts (hosters)"""
+SITE_RATE = (2.0, 6)
+HOSTER_RATE = (1.0, 4)
+"""how many tokens of a bucket background tasks leave for the user's requests"""
+BACKGROUND_RESERVE = 2
+
+"""the most time, in seconds, a request waits for a token before going anyway"""
+MAX_WAIT = 30
+
+LOCK_TIMEOUT = 5
+
+_buckets = {}
+_locks = {}
+_locksLock = threading.Lock()
+
+
+def acquire(url):
+    '''wait until a request to an url may be made, taking a token from its host's bucket
+    @param url: the absolute url of the request
+    @return: how long, in seconds, the request waited'''
+    host, rate, burst, priority, reserve = _getBucket(url)
+    if not host:
+        return 0
+
+    start = time.time()
+    waited = 0
+    while True:
+        wait = _take(host, rate, burst, reserve, priority, waited, waited >= MAX_WAIT)
+        if wait is None:
+            if waited:
+                log.debug("%s request to %s waited %.2fs", priority, host, waited)
+            return waited
+        time.sleep(min(wait, MAX_WAIT - waited + 0.01))
+        waited = time.time() - start
+
+
+def tryAcquire(url):
+    '''take a token from the bucket of an url's host only if there is one right away, for requests that are not
+    worth waiting for (ie: hedged requests, @see: deadlines)
+    @param url: the absolute url of the request
+    @return: true if a token was taken and the request may be made'''
+    host, rate, burst, priority, reserve = _getBucket(url)
+    return not host or _take(host, rate, burst, reserve, priority, 0) is None
+
+
+def _getBucket(url):
+    '''get the host of an url, the rate and burst size of its bucket, and the priority and reserve of the current
+    thread's requests
+    @return: the (host, rate, burst, priority, reserve) tuple'''
+    host = urlparse.urlparse(url)[1].lower()
+    rate, burst = mirrors.isSite(url) and SITE_RATE or HOSTER_RATE
+    priority = background.isBackground() and BACKGROUND or FOREGROUND
+    reserve = priority == BACKGROUND and BACKGROUND_RESERVE or 0
+    return host, rate, burst, priority, reserve
+
+
+def _take(host, rate, burst, reserve, priority, waited, force=False):
+    '''take a token from a host's bucket, if there is one to take
+    @param waited: how long the request waited so far
+    @param force: if the token is taken even if the bucket is empty (after waiting too long)
+    @return: None if a token was taken, how long to wait for one otherwise'''
+    path = storage.getPath("ratelimit", hashlib.md5(host).hexdigest() + ".pickle")
+    lock = _getLock(host)
+    lock.acquire()
+    try:
+        with filelock.FileLock(path and path + ".lock", LOCK_TIMEOUT):
+            bucket = _read(path) or _buckets.get(host) or {'host': host, 'tokens': burst, 'time': time.time(),
+                                                           'waits': {}}
+            now = time.time()
+            bucket['tokens'] = min(burst, bucket['tokens'] + (now - bucket['time']) * rate)
+            bucket['time'] = now
+            if bucket['tokens'] < 1 + reserve and not force:
+                return (1 + reserve - bucket['tokens']) / rate
+            bucket['tokens'] -= 1
+            if waited:
+                count, total, longest = bucket['waits'].get(priority, (0, 0, 0))
+                bucket['waits'][priority] = (count + 1, total + waited, max(longest, waited))
+            _buckets[host] = bucket
+            if path:
+                # a bucket lost in a crash is only a burst of requests, not worth syncing to the disk every request
+                storage.writeAtomically(path, cPickle.dumps(bucket, cPickle.HIGHEST_PROTOCOL), sync=False)
+            return None
+    except (filelock.LockTimeout, IOError, OSError):
+        log.exception("Failed to take a token for %s, not limiting the request", host)
+        return None
+    finally:
+        lock.release()
+
+
+def _getLock(host):
+    '''get the lock of a host's bucket, so that requests to other hosts do not wait for it'''
+    _locksLock.acquire()
+    try:
+        lock = _locks.get(host)
+        if lock is None:
+            lock = _locks[host] = threading.Lock()
+        return lock
+    finally:
+        _locksLock.release()
+
+
+def getStats():
+    '''get the wait-time metrics of the requests
+    @return: a dict with, for each host, a dict with the (number of waits, total seconds waited, longest wait)
+        of each priority (FOREGROUND and BACKGROUND)'''
+    buckets = dict(_buckets)
+    directory = storage.getPath("ratelimit", "")
+    if directory and os.path.isdir(directory):
+        for name in os.listdir(directory):
+            if name.endswith(".pickle"):
+                bucket = _read(os.path.join(directory, name))
+                if bucket:
+                    buckets[bucket['host']] = bucket
+    return dict([(host, bucket['waits']) for host, bucket in buckets.items()])
+
+
+def _read(path):
+    if not path or not os.path.isfile(path):
+        return None
+    try:
+        input = open(path, 'rb')
+        try:
+            return cPickle.load(input)
+        finally:
+            input.close()
+    except (IOError, EOFError, cPickle.UnpicklingError):
+        log.exception("Failed to read the bucket in '%s'", path)
+        return None
@@ -0,0 +1,177 @@
+# -*- coding: UTF-8 -*-
+'''
+A resident service that keeps the plugin loaded between invocations.
+
+XBMC runs the plugin in a new interpreter for every click, so every click pays for loading the modules,
+the metadata facade and the caches. When the service is running (@see: service.py) the plugin's entry point
+only forwards its invocation arguments to it, over a local unix socket in the add-on's profile directory,
+and sends the results recorded by the service (@see: pluginsupport.RecordingOutput) to XBMC.
+If the service is not available, or fails to handle an invocation, the plugin handles the invocation itself.
+
+Messages are pickles prefixed by their length. The service answers each invocation with a tuple
+(status, result), where result is the list of recorded calls when status is 'ok'.
+
+Created on Oct 19, 2026
+
+@author: pguedes
+'''
+import cPickle, os, socket, struct, sys, threading, traceback
+from utils import logs
+
+log = logs.getLogger("service")
+
+SOCKET_NAME = "service.sock"
+
+"""how long, in seconds, the plugin waits to connect to the service before handling invocations itself"""
+CONNECT_TIMEOUT = 0.5
+
+STATUS_OK, STATUS_ERROR = 'ok', 'error'
+
+
+class ServiceError(Exception):
+    '''exception raised when the service failed to handle an invocation'''
+    pass
+
+
+def isSupported():
+    '''check if the service can run on this platform (it needs unix sockets)
+    @return: true if the service is supported'''
+    return hasattr(socket, 'AF_UNIX')
+
+
+def getSocketPath(addonId):
+    '''get the path of the service's socket for an add-on
+    @param addonId: the id of the add-on
+    @return: the path of the socket'''
+    import xbmc, xbmcaddon
+
+    return os.path.join(xbmc.translatePath(xbmcaddon.Addon(addonId).getAddonInfo('profile')), SOCKET_NAME)
+
+
+def _send(connection, message):
+    data = cPickle.dumps(message, cPickle.HIGHEST_PROTOCOL)
+    connection.sendall(struct.pack("!I", len(data)) + data)
+
+
+def _receiveExactly(connection, size):
+    chunks = []
+    while size:
+        chunk = connection.recv(min(size, 65536))
+        if not chunk:
+            raise socket.error("connection closed")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return "".join(chunks)
+
+
+def _receive(connection):
+    size, = struct.unpack("!I", _receiveExactly(connection, 4))
+    return cPickle.loads(_receiveExactly(connection, size))
+
+
+def forward(socketPath, argv):
+    '''forward an invocation of the plugin to the service
+    @param socketPath: the path of the service's socket
+    @param argv: the invocation arguments (sys.argv)
+    @return: the calls recorded by the service, or None if the service is not available
+    @raise ServiceError: if the service failed to handle the invocation'''
+    if not isSupported() or not os.path.exists(socketPath):
+        return None
+
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.settimeout(CONNECT_TIMEOUT)
+        try:
+            connection.connect(socketPath)
+        except socket.error:
+            return None
+        # the service may need the user's input (ie: select a source), so there is no timeout from now on
+        connection.settimeout(None)
+        try:
+            _send(connection, list(argv))
+            status, result = _receive(connection)
+        except socket.error:
+            log.exception("Lost connection to the service")
+            return None
+    finally:
+        connection.close()
+
+    if status == STATUS_ERROR:
+        raise ServiceError(result)
+    return result
+
+
+def forwardInvocation(addonId):
+    '''forward the current invocation of the plugin to the service and send its results to XBMC
+    @param addonId: the id of the add-on
+    @return: true if the service handled the invocation, false if the plugin should handle it'''
+    if not isSupported():
+        return False
+
+    from utils import pluginsupport
+
+    try:
+        calls = forward(getSocketPath(addonId), sys.argv)
+    except ServiceError:
+        # the service logs its failures, and nothing was sent to XBMC yet, so the plugin tries it again
+        log.warning("The service failed to handle the invocation, handling it in the plugin")
+        return False
+    if calls is None:
+        return False
+    pluginsupport.replay(calls)
+    return True
+
+
+class Server(object):
+    '''the service end of the socket: receives forwarded invocations and handles them.
+    Each invocation is handled on a thread of its own, at the same time as the others (ie: a listing loads while
+    another invocation waits for the user to select a source), so the handler must not use sys.argv.'''
+
+    ACCEPT_TIMEOUT = 1
+
+    def __init__(self, socketPath, handler):
+        '''create a server (not listening yet)
+        @param socketPath: the path of the socket to listen on
+        @param handler: a function that handles an invocation, called with its arguments, and returns the calls to
+            send to XBMC'''
+        self.socketPath = socketPath
+        self.handler = handler
+
+    def serve(self, shouldStop):
+        '''listen for invocations until told to stop
+        @param shouldStop: a function that returns true when the server should stop'''
+        if os.path.exists(self.socketPath):
+            os.remove(self.socketPath)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            listener.bind(self.socketPath)
+            listener.listen(5)
+            listener.settimeout(self.ACCEPT_TIMEOUT)
+            log.info("listening for invocations on '%s'", self.socketPath)
+            while not shouldStop():
+                try:
+                    connection, address = listener.accept()
+                except socket.timeout:
+                    continue
+                worker = threading.Thread(target=self.__handleConnection, args=(connection,))
+                worker.setDaemon(True)
+                worker.start()
+        finally:
+            listener.close()
+            if os.path.exists(self.socketPath):
+                os.remove(self.socketPath)
+
+    def __handleConnection(self, connection):
+        try:
+            connection.settimeout(None)
+            argv = _receive(connection)
+            try:
+                response = (STATUS_OK, self.handler(argv))
+            except:
+                log.exception("Failed to handle invocation: %s", argv)
+                response = (STATUS_ERROR, traceback.format_exc())
+            _send(connection, response)
+        except:
+            log.exception("Failed to talk to the plugin")
+        finally:
+            connection.close()
@@ -8,7 +8,11 @@ import sys, xbmcplugin #@UnresolvedImport
 def get(setting):
 #  return xbmcplugin.getSetting(setting);
   # Dharma settings...
-  return xbmcplugin.getSetting(int(sys.argv[1]), setting);
+  if len(sys.argv) > 1 and sys.argv[1].isdigit():
+    return xbmcplugin.getSetting(int(sys.argv[1]), setting);
+  # no plugin handle when running in the service (or in its background tasks)
+  import xbmcaddon #@UnresolvedImport
+  return xbmcaddon.Addon().getSetting(setting);
 
 def isSet(setting):
-  return get(setting) == "true";
\ No newline at end of file
+  return get(setting) == "true";
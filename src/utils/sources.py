@@ -12,16 +12,28 @@ By instantiating a Source, you get an object with a 'resolve' method that will c
 the collected links or raise an exception if it cannot.
 
 The SourceList class implements the logic of selecting a Source out of a set of currently available ones.
+It can leave out the links to hosters that no installed resolver supports (@see: HosterIndex).
 
 Actually resolving the links is handled by a separate module by ElDorado (script.module.urlresolver)
 
 @author: pguedes
 """
 from utils.pluginsupport import select
-import logging
-from utils import notification
+import collections, hashlib, imp, os, urllib2, urlparse
+from utils import notification, cache, deadlines, logs
 
-log = logging.getLogger("linkresolvers")
+log = logs.getLogger("linkresolvers")
+
+"""how long, in seconds, resolved links are reused (they usually expire on the hoster after a while)"""
+RESOLVED_CACHE_TIME = 15 * 60
+
+DEAD_LINK_REMOVED, DEAD_LINK_TIMEOUT, DEAD_LINK_ERROR = 'removed', 'timeout', 'error'
+"""how long, in seconds, hoster links that failed to resolve are skipped, by how they failed"""
+DEAD_LINK_TIMES = {DEAD_LINK_REMOVED: 24 * 60 * 60,
+                   DEAD_LINK_TIMEOUT: 5 * 60,
+                   DEAD_LINK_ERROR: 30 * 60}
+"""words in the errors of resolvers that mean the file was removed from the hoster"""
+REMOVED_FILE_MESSAGES = ('removed', 'not found', 'deleted', 'no longer', 'does not exist')
 
 
 class UnresolvableSourceException(Exception):
@@ -50,7 +62,13 @@ class SourceList(object):
     @see: selectSource"""
     def __init__(self, links, filterUnsupportedSources=False):
         """create a new SourceList to select from a list of sources.
-        @param links: a list of tuples with (url, name) of sources to use as choices for source selection"""
+        @param links: a list of tuples with (url, name) of sources to use as choices for source selection
+        @param filterUnsupportedSources: if links to hosters the installed resolvers do not support are left out"""
+        if filterUnsupportedSources:
+            index = getHosterIndex()
+            supported = [(url, source) for url, source in links if index.supports(url)]
+            log.debug("left out %d links to unsupported hosters", len(links) - len(supported))
+            links = supported
         self.sources = {}
         for url, source in links:
             self.sources.setdefault(source, []).append(url)
@@ -62,7 +80,7 @@ class SourceList(object):
         @param autoplay: the preferred source to auto-select if choosing is involved
         @return: the selected Source
         @raise NoSourceSelectedException: raised when no source was selected"""
-        log.debug("Selecting from sources: %r" % self.sources)
+        log.debug("Selecting from sources: %r", self.sources)
 
         sources = self.sources
         if forceSourceSelection:
@@ -102,14 +120,116 @@ class SourceList(object):
 
     def __getNumberedSources(self):
         """get a numbered version of the source list so that the user can select one (megavideo#1, megavideo#2, ...)
+        Links that recently failed to resolve are listed last, with how they failed (megavideo#3 (removed))
         @return: a map equivalent to the current available sources, but where the keys have numbers"""
-        flattenedSources = {}
+        flattenedSources = collections.OrderedDict()
+        deadSources = []
         for source, urls in self.sources.iteritems():
             for url in urls:
-                flattenedSources["%s#%d" % (source, urls.index(url))] = [url]
+                failure = getDeadLinkFailure(url)
+                if failure:
+                    deadSources.append(("%s#%d (%s)" % (source, urls.index(url), failure), [url]))
+                else:
+                    flattenedSources["%s#%d" % (source, urls.index(url))] = [url]
+        flattenedSources.update(deadSources)
         return flattenedSources
 
 
+class HosterIndex(object):
+    """the domains of the hosters supported by the installed resolvers, to check links without asking the resolvers.
+    A link is supported if its host, or any domain its host is in, is in the index (ie: the index domain
+    'putlocker.com' supports links on 'www.putlocker.com' and 'media.putlocker.com').
+    Resolvers that do not tell their domains cannot be indexed, so when there are any the index is incomplete and
+    links it does not match are checked by the resolvers."""
+
+    def __init__(self, domains, complete=True):
+        """create an index
+        @param domains: the domains of the supported hosters
+        @param complete: if every installed resolver is in the index"""
+        self.domains = frozenset(domains)
+        self.complete = complete
+
+    def supports(self, url):
+        """check if a link is to a supported hoster
+        @param url: the link
+        @return: true if an installed resolver supports the link's hoster"""
+        host = urlparse.urlparse(url)[1].lower().rsplit('@', 1)[-1].split(':')[0]
+        parts = host.split('.')
+        for index in range(len(parts) - 1):
+            if '.'.join(parts[index:]) in self.domains:
+                return True
+        if self.complete:
+            return False
+        from urlresolver import HostedMediaFile
+
+        return HostedMediaFile(url).valid_url()
+
+
+_hosterIndex = None
+
+
+def getHosterIndex():
+    """get the index of the hosters supported by the installed resolvers.
+    Building the index loads every resolver, so it is cached and only built again when the installed resolvers
+    change (@see: _getResolversVersion)
+    @return: the HosterIndex"""
+    global _hosterIndex
+    version = _getResolversVersion()
+    if _hosterIndex is None or _hosterIndex[0] != version:
+        if version is None:
+            domains, complete = _indexResolvers()
+        else:
+            domains, complete = cache.hosters.getVersioned("index", version, _indexResolvers)
+        _hosterIndex = (version, HosterIndex(domains, complete))
+    return _hosterIndex[1]
+
+
+def _getResolversVersion():
+    """identify the installed resolvers by the files of the urlresolver module's plugins, without importing it
+    @return: the version of the installed resolvers, or None if it cannot be found"""
+    try:
+        path = imp.find_module('urlresolver')[1]
+    except ImportError:
+        return None
+    plugins = os.path.join(path, 'plugins')
+    if not os.path.isdir(plugins):
+        return None
+    digest = hashlib.md5()
+    for name in sorted(os.listdir(plugins)):
+        digest.update("%s:%d;" % (name, os.path.getmtime(os.path.join(plugins, name))))
+    return digest.hexdigest()
+
+
+def _indexResolvers():
+    """list the domains the installed resolvers support
+    @return: a tuple with the list of domains and true if every resolver was indexed"""
+    import urlresolver
+
+    if hasattr(urlresolver, 'relevant_resolvers'):
+        resolvers = urlresolver.relevant_resolvers(include_universal=True)
+    elif hasattr(urlresolver, 'plugnplay'):
+        resolvers = urlresolver.plugnplay.man.implementors(urlresolver.UrlResolver)
+    else:
+        log.warning("Could not list the installed resolvers, links will be checked by the resolvers")
+        return [], False
+
+    domains = set()
+    complete = True
+    for resolver in resolvers:
+        resolverDomains = getattr(resolver, 'domains', None)
+        if not resolverDomains or '*' in resolverDomains:
+            # resolvers without domains (or for any domain) have to check the links themselves
+            complete = False
+            continue
+        for domain in resolverDomains:
+            domain = domain.lower()
+            if domain.startswith('www.'):
+                domain = domain[4:]
+            domains.add(domain)
+    log.debug("indexed %d hoster domains (complete: %s)", len(domains), complete)
+    return sorted(domains), complete
+
+
 class Source(object):
     """represents  source of a certain media file that this module can translate into playable urls
     A source uses a link resolver to to the host specific tricks to ge the links.
@@ -122,10 +242,21 @@ class Source(object):
         loop through all available link resolvers and try until one succeeds, as a fallback.
         @param urls: the urls on the host that should be translated into playable files
         @param type: the source type (this maps to the LinkResolver implementation to use)"""
-        log.warning("type: %s" % str(type))
+        log.warning("type: %s", type)
         self.__sourceName = type
         self.__urls = urls
 
+    def getName(self):
+        """get the name of this source
+        @return: the source type"""
+        return self.__sourceName
+
+    def getHosterName(self):
+        """get the name of the hoster of this source, without the number (and failure) it has when the user
+        selected it from the numbered sources (megavideo#2 (removed) is on megavideo)
+        @return: the name of the hoster"""
+        return self.__sourceName.split('#')[0]
+
     def __resolveAlternate(self, url):
         """resolve one of the alternate links for a certain media target.
         will make the request to load the html page and pass it on to the LinkResolver to do the actual resolving
@@ -133,24 +264,42 @@ class Source(object):
         @return: the resolved playable url
         @raise UnresolvableSourceException: if we found no links for this alternate url"""
 
+        links = cache.resolved.get(url)
+        if links:
+            log.debug("Reusing resolved link for %s: %s", url, links)
+            return links
+
         from urlresolver import HostedMediaFile
 
-        log.debug("Resolving alternative link %s" % (url))
-        links = HostedMediaFile(url).resolve()
-        log.debug("resolved:  %s" % links)
+        log.debug("Resolving alternative link %s", url)
+        try:
+            links = HostedMediaFile(url).resolve()
+        except Exception as e:
+            _rememberDeadLink(url, _getFailure(e))
+            raise
+        log.debug("resolved:  %s", links)
         if links:
-            log.debug("Found part items: %s" % links)
+            log.debug("Found part items: %s", links)
+            cache.resolved.put(url, links, RESOLVED_CACHE_TIME)
+            if getDeadLinkFailure(url):
+                cache.deadLinks.touch(url, 0)
             return links
+        _rememberDeadLink(url, DEAD_LINK_REMOVED)
         raise UnresolvableSourceException("No links found for '%s' on host '%s'" % (url, self.__sourceName))
 
-    def resolve(self):
+    def resolve(self, notify=True):
         """resolves one of the available alternate versions of a playable item
+        @param notify: if the user should be notified of the progress (False when resolving in the background)
         @return: the resolved playable url for XBMC
         @raise UnresolvableSourceException: if none of the alternate links can be resolved"""
-        for url in self.__urls:
+        # links that recently failed are skipped, unless they all did
+        urls = [url for url in self.__urls if not getDeadLinkFailure(url)] or self.__urls
+        for url in urls:
+            notifier = notification.NullNotifier()
             try:
-                notifier = notification.getUserNotifier('Looking for playable link...', 'trying link %s of %s' % (
-                self.__urls.index(url), len(self.__urls)))
+                if notify:
+                    notifier = notification.getUserNotifier('Looking for playable link...', 'trying link %s of %s' % (
+                    urls.index(url), len(urls)))
                 try:
                     return self.__resolveAlternate(url)
                 except:
@@ -158,3 +307,32 @@ class Source(object):
             finally:
                 notifier.close()
         raise UnresolvableSourceException("No links found on %s" % self.__sourceName)
+
+
+def getDeadLinkFailure(url):
+    """check if a hoster link recently failed to resolve
+    @param url: the hoster link
+    @return: how the link failed (DEAD_LINK_REMOVED, DEAD_LINK_TIMEOUT or DEAD_LINK_ERROR), or None if it did not"""
+    return cache.deadLinks.get(url)
+
+
+def _rememberDeadLink(url, failure):
+    log.debug("remembering link %s as dead (%s)", url, failure)
+    cache.deadLinks.put(url, failure, DEAD_LINK_TIMES[failure])
+
+
+def _getFailure(error):
+    """classify the error a resolver raised
+    @return: DEAD_LINK_TIMEOUT, DEAD_LINK_REMOVED or DEAD_LINK_ERROR"""
+    if deadlines.isTimeout(error):
+        return DEAD_LINK_TIMEOUT
+    if isinstance(error, urllib2.HTTPError) and error.code in (404, 410):
+        return DEAD_LINK_REMOVED
+    try:
+        message = str(error).lower()
+    except UnicodeError:
+        message = ''
+    for removed in REMOVED_FILE_MESSAGES:
+        if removed in message:
+            return DEAD_LINK_REMOVED
+    return DEAD_LINK_ERROR
@@ -0,0 +1,78 @@
+# -*- coding: UTF-8 -*-
+'''
+Locations of the files this add-on keeps in its profile directory (caches, cookies, ...).
+
+The profile directory is only known once the plugin is initialized (@see: plugin.initialize),
+so modules that need to persist state ask for their paths here instead of building them.
+When storage was not initialized (ie: running outside XBMC) getPath returns None and callers
+should behave as if there was no persistent storage.
+
+Created on Oct 19, 2026
+
+@author: pguedes
+'''
+import os, threading
+
+_root = None
+
+
+def initialize(root):
+    '''set the directory where this add-on keeps its files
+    @param root: the add-on's profile directory'''
+    global _root
+    _root = root
+
+
+def getPath(*parts):
+    '''get the path to a file in the add-on's profile directory, creating the parent folders if needed
+    @param parts: the path components, relative to the profile directory
+    @return: the path to the file, or None if storage was not initialized'''
+    if not _root:
+        return None
+    path = os.path.join(_root, *parts)
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            # another process may have just created it
+            if not os.path.isdir(directory):
+                raise
+    return path
+
+
+def writeAtomically(path, data, sync=True):
+    '''write a file so that readers either see the old or the new contents, never a partial write
+    @param path: the file to write
+    @param data: the contents to write
+    @param sync: if the contents are flushed to the disk before they replace the old ones (so that a crash
+        does not leave an empty file), which is slow on the flash storage of set-top boxes'''
+    writeChunksAtomically(path, [data], sync)
+
+
+def writeChunksAtomically(path, chunks, sync=True):
+    '''write a file from an iterable of chunks, so that readers either see the old or the new contents, never a
+    partial write (@see: writeAtomically)
+    @param path: the file to write
+    @param chunks: an iterable with the contents to write
+    @param sync: if the contents are flushed to the disk before they replace the old ones'''
+    temporary = "%s.%d.%d.tmp" % (path, os.getpid(), threading.currentThread().ident)
+    output = open(temporary, 'wb')
+    try:
+        try:
+            for chunk in chunks:
+                output.write(chunk)
+            if sync:
+                output.flush()
+                os.fsync(output.fileno())
+        finally:
+            output.close()
+    except:
+        os.remove(temporary)
+        raise
+    try:
+        os.rename(temporary, path)
+    except OSError:
+        # windows will not rename over an existing file
+        os.remove(path)
+        os.rename(temporary, path)
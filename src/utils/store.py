@@ -0,0 +1,354 @@
+# -*- coding: UTF-8 -*-
+'''
+Stores of values shared by the plugin's processes, for the caches (@see: cache).
+
+Every click in XBMC runs the plugin in a new process, so nothing cached in memory survives until the next click,
+and opening and decoding a file for every cache entry costs part of each click's time. A Store keeps its values
+in an append-only data file, with an index of fixed layout (a hash table of the md5 of the keys) pointing at
+them. Both files are memory-mapped, so a lookup only reads a slot or two of the index and then the value it
+points at, without reading or decoding the rest of the files.
+
+Readers take no locks. Writers (one at a time, under a FileLock) append the value to the data file before
+pointing the index at it, and values are stored with the md5 of their key and a checksum, so a reader that sees
+a half-written update (or what a crash left behind) misses instead of getting a wrong value.
+
+Values that were replaced stay in the data file until it is compacted: when it is mostly garbage, or when the
+index is too full, the live values are copied to a new data file with a new (bigger if needed) index, which
+replace the old ones atomically (@see: storage.writeAtomically). Values are stored with their key, so that a
+compaction can also drop the values that are not needed anymore (@see: compact).
+
+Created on Oct 19, 2026
+
+@author: pguedes
+'''
+import hashlib, mmap, os, struct, threading, zlib
+from utils import filelock, logs, storage
+
+log = logs.getLogger("store")
+
+MAGIC = "PWIX"
+FORMAT = 2
+DATA_MAGIC = "PWDT\0\0\0\0"
+
+"""the index starts with a header: magic, format, generation of the data file, slots, entries, live bytes"""
+HEADER = struct.Struct(">4sIIIIQ")
+"""followed by its slots: md5 of the key, offset and length of the value (offset 0 for an empty slot)"""
+SLOT = struct.Struct(">16sQI4x")
+"""values in the data file are preceded by the md5 of their key, the length of the key and of the value, the crc32
+of both, and the key"""
+RECORD = struct.Struct(">16sHII")
+
+"""how many slots a new index has"""
+INITIAL_SLOTS = 1024
+"""how full the index can get before it is rebuilt with twice the slots"""
+MAX_LOAD = 0.5
+"""a data file bigger than COMPACT_MIN_SIZE bytes is compacted when more than COMPACT_GARBAGE of it is garbage"""
+COMPACT_MIN_SIZE = 4 * 1024 * 1024
+COMPACT_GARBAGE = 0.5
+
+LOCK_TIMEOUT = 10
+
+
+class Store(object):
+    '''a named store of string values, in the profile directory'''
+
+    def __init__(self, name):
+        '''create a store (its files are created when the first value is stored)
+        @param name: the name of the store (the folder it uses in the profile directory)'''
+        self.name = name
+        self.__lock = threading.RLock()
+        self.__files = None
+        self.__invalid = None
+
+    def __path(self, name):
+        return storage.getPath("store", self.name, name)
+
+    def isAvailable(self):
+        '''check if there is storage for this store
+        @return: true if values can be stored'''
+        return self.__path("lock") is not None
+
+    def get(self, key):
+        '''get a value
+        @param key: the key of the value
+        @return: the value, or None if there is no value for the key (or no storage)'''
+        digest = hashlib.md5(key).digest()
+        with self.__lock:
+            files = self.__open()
+            if files is None:
+                return None
+            position, offset, length = files.find(digest)
+            if not offset:
+                return None
+            return files.read(digest, offset, length)
+
+    def put(self, key, value):
+        '''store a value, replacing the value of the same key
+        @param key: the key of the value
+        @param value: the string to store
+        @return: true if the value was stored, false if there is no storage (or it failed)'''
+        lockPath = self.__path("lock")
+        if not lockPath:
+            return False
+        try:
+            with filelock.FileLock(lockPath, LOCK_TIMEOUT):
+                with self.__lock:
+                    self.__put(key, value)
+            return True
+        except (filelock.LockTimeout, EnvironmentError, ValueError):
+            log.exception("Failed to store a value in '%s'", self.name)
+            self.__close()
+            return False
+
+    def compact(self, keep=None):
+        '''compact the store now, dropping the values that are not needed anymore
+        @param keep: a function called with the key of each value, that returns false for the values to drop
+            (None to keep them all)
+        @return: true if the store was compacted, false if it has no files (or it failed)'''
+        lockPath = self.__path("lock")
+        if not lockPath:
+            return False
+        try:
+            with filelock.FileLock(lockPath, LOCK_TIMEOUT):
+                with self.__lock:
+                    files = self.__open()
+                    if files is None:
+                        return False
+                    self.__rebuild(files, files.slots, keep)
+            return True
+        except (filelock.LockTimeout, EnvironmentError, ValueError):
+            log.exception("Failed to compact '%s'", self.name)
+            self.__close()
+            return False
+
+    def __put(self, key, value):
+        digest = hashlib.md5(key).digest()
+        files = self.__open() or self.__rebuild(None, INITIAL_SLOTS)
+        position, offset, length = files.find(digest)
+        entries, live = files.getCounts()
+        if position is None or not offset and entries + 1 > files.slots * MAX_LOAD:
+            files = self.__rebuild(files, files.slots * 2)
+            position, offset, length = files.find(digest)
+            entries, live = files.getCounts()
+
+        newOffset = files.append(digest, key, value)
+        files.setSlot(position, digest, newOffset, len(value))
+        if offset:
+            live -= RECORD.size + len(key) + length
+        else:
+            entries += 1
+        live += RECORD.size + len(key) + len(value)
+        files.setCounts(entries, live)
+
+        size = files.getDataSize()
+        if size > COMPACT_MIN_SIZE and live < size * (1 - COMPACT_GARBAGE):
+            self.__rebuild(files, files.slots)
+
+    def __open(self):
+        '''get the files of the current generation of the store, opening them if they were replaced
+        @return: the _Files, or None if the store has no (valid) files'''
+        indexPath = self.__path("index")
+        if not indexPath:
+            return None
+        try:
+            stat = os.stat(indexPath)
+        except OSError:
+            self.__close()
+            return None
+        identity = (stat.st_dev, stat.st_ino)
+        if self.__files is not None and self.__files.identity == identity:
+            return self.__files
+        self.__close()
+        if identity == self.__invalid:
+            return None
+        try:
+            self.__files = _Files(identity, indexPath, self.__path)
+        except (EnvironmentError, ValueError, struct.error):
+            log.exception("Failed to open store '%s', it will be rebuilt", self.name)
+            self.__invalid = identity
+        return self.__files
+
+    def __close(self):
+        if self.__files is not None:
+            self.__files.close()
+            self.__files = None
+
+    def __rebuild(self, files, slots, keep=None):
+        '''write a new generation of the store with the live values of the current one (compacting it)
+        @param files: the _Files of the current generation (None to create an empty store)
+        @param slots: the number of slots of the new index
+        @param keep: a function that returns false for the keys of the values to drop (@see: compact)
+        @return: the _Files of the new generation'''
+        generation = files and files.generation + 1 or 1
+        records = files and files.iterRecords() or iter(())
+        log.debug("rebuilding store '%s' with %d slots (generation %d)", self.name, slots, generation)
+        index = bytearray(HEADER.size + slots * SLOT.size)
+        counts = [0, 0]
+
+        def chunks():
+            # the data file, filling the index as the values are written
+            yield DATA_MAGIC
+            offset = len(DATA_MAGIC)
+            for key, digest, value in records:
+                if keep and not keep(key):
+                    continue
+                position = _findFree(index, slots, digest)
+                SLOT.pack_into(index, position, digest, offset, len(value))
+                record = _pack(digest, key, value)
+                yield record
+                yield value
+                offset += len(record) + len(value)
+                counts[0] += 1
+                counts[1] += len(record) + len(value)
+
+        storage.writeChunksAtomically(self.__path("data.%d" % generation), chunks())
+        HEADER.pack_into(index, 0, MAGIC, FORMAT, generation, slots, counts[0], counts[1])
+        # windows does not replace files that are open
+        self.__close()
+        storage.writeAtomically(self.__path("index"), str(index))
+        self.__removeOldData(generation)
+        files = self.__open()
+        if files is None:
+            raise IOError("failed to open the rebuilt store '%s'" % self.name)
+        return files
+
+    def __removeOldData(self, generation):
+        directory = os.path.dirname(self.__path("index"))
+        for name in os.listdir(directory):
+            if name.startswith("data.") and name != "data.%d" % generation and not name.endswith(".tmp"):
+                try:
+                    os.remove(os.path.join(directory, name))
+                except OSError:
+                    # still open in another process (windows), removed by the next compaction
+                    log.debug("could not remove old data file '%s'", name)
+
+
+class _Files(object):
+    '''the memory-mapped index and data file of a generation of a store'''
+
+    def __init__(self, identity, indexPath, getPath):
+        self.identity = identity
+        self.indexFile = open(indexPath, 'r+b')
+        self.index = self.dataFile = self.data = None
+        try:
+            self.index = mmap.mmap(self.indexFile.fileno(), 0)
+            magic, format, self.generation, self.slots, entries, live = HEADER.unpack_from(self.index, 0)
+            if magic != MAGIC or format != FORMAT or len(self.index) < HEADER.size + self.slots * SLOT.size:
+                raise ValueError("invalid index '%s'" % indexPath)
+            self.dataFile = open(getPath("data.%d" % self.generation), 'r+b')
+            self.__mapData()
+        except:
+            self.close()
+            raise
+
+    def __mapData(self):
+        if self.data is not None:
+            self.data.close()
+        self.data = mmap.mmap(self.dataFile.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def close(self):
+        for resource in (self.data, self.dataFile, self.index, self.indexFile):
+            if resource is not None:
+                resource.close()
+
+    def getCounts(self):
+        return HEADER.unpack_from(self.index, 0)[4:]
+
+    def setCounts(self, entries, live):
+        HEADER.pack_into(self.index, 0, MAGIC, FORMAT, self.generation, self.slots, entries, live)
+
+    def getDataSize(self):
+        return os.fstat(self.dataFile.fileno()).st_size
+
+    def find(self, digest):
+        '''find the slot of a key
+        @param digest: the md5 of the key
+        @return: the (position, offset, length) of the key's slot (offset 0 if the key is not in the index,
+            position None if the index is full)'''
+        position = _firstSlot(digest, self.slots)
+        for probe in range(self.slots):
+            slotDigest, offset, length = SLOT.unpack_from(self.index, position)
+            if not offset or slotDigest == digest:
+                return position, offset, length
+            position = _nextSlot(position, self.slots)
+        return None, 0, 0
+
+    def setSlot(self, position, digest, offset, length):
+        self.index[position:position + SLOT.size] = SLOT.pack(digest, offset, length)
+
+    def read(self, digest, offset, length):
+        '''read a value, checking it is whole and of the right key
+        @return: the value, or None if the data file does not have it'''
+        record = self.readRecord(digest, offset, length)
+        return record and record[1]
+
+    def readRecord(self, digest, offset, length):
+        '''read a value and its key, checking they are whole
+        @return: the (key, value), or None if the data file does not have them'''
+        if not self.__isMapped(offset + RECORD.size):
+            return None
+        recordDigest, keyLength, recordLength, checksum = RECORD.unpack_from(self.data, offset)
+        start = offset + RECORD.size + keyLength
+        if recordDigest != digest or recordLength != length or not self.__isMapped(start + length):
+            return self.__invalid(offset)
+        key = self.data[offset + RECORD.size:start]
+        value = self.data[start:start + length]
+        if _checksum(key, value) != checksum:
+            return self.__invalid(offset)
+        return key, value
+
+    def __isMapped(self, end):
+        if end > len(self.data):
+            # appended by another process since it was mapped
+            self.__mapData()
+        return end <= len(self.data)
+
+    def __invalid(self, offset):
+        log.warning("Ignoring an invalid value at offset %d of a store", offset)
+        return None
+
+    def append(self, digest, key, value):
+        '''append a value to the data file
+        @return: the offset of the value's record'''
+        self.dataFile.seek(0, os.SEEK_END)
+        offset = self.dataFile.tell()
+        self.dataFile.write(_pack(digest, key, value) + value)
+        self.dataFile.flush()
+        return offset
+
+    def iterRecords(self):
+        '''iterate the live values
+        @return: a generator of (key, digest, value) of the values the index points at'''
+        for slot in range(self.slots):
+            digest, offset, length = SLOT.unpack_from(self.index, HEADER.size + slot * SLOT.size)
+            if offset:
+                record = self.readRecord(digest, offset, length)
+                if record is not None:
+                    yield record[0], digest, record[1]
+
+
+def _firstSlot(digest, slots):
+    return HEADER.size + struct.unpack_from(">Q", digest)[0] % slots * SLOT.size
+
+
+def _nextSlot(position, slots):
+    position += SLOT.size
+    if position >= HEADER.size + slots * SLOT.size:
+        position = HEADER.size
+    return position
+
+
+def _findFree(index, slots, digest):
+    position = _firstSlot(digest, slots)
+    while SLOT.unpack_from(index, position)[1]:
+        position = _nextSlot(position, slots)
+    return position
+
+
+def _pack(digest, key, value):
+    '''pack the header of a value's record, followed by its key'''
+    return RECORD.pack(digest, len(key), len(value), _checksum(key, value)) + key
+
+
+def _checksum(key, value):
+    return zlib.crc32(value, zlib.crc32(key)) & 0xffffffff
@@ -0,0 +1,146 @@
+# -*- coding: UTF-8 -*-
+'''
+Warming of the plugin's caches while the user is idle.
+
+Users open the same listings every day (the root categories and the shows they follow), so once a day, after
+the configured hour and while XBMC is idle, the service refreshes those listings and their metadata
+(@see: schedule) and the first click of the day is served from warm caches.
+
+Warming runs within a budget of requests, bytes and time (@see: Budget) so that it never takes over the
+user's connection. The shows to warm are the ones the user visited most recently (@see: rememberVisit).
+
+Created on Oct 19, 2026
+
+@author: pguedes
+'''
+import cPickle, datetime, os, time
+import xbmc #@UnresolvedImport
+from utils import background, deadlines, filelock, logs, settings, storage
+
+log = logs.getLogger("warming")
+
+"""how often, in seconds, the scheduler checks if it is time to warm the caches"""
+CHECK_INTERVAL = 5 * 60
+"""how long, in seconds, XBMC must be idle before the caches are warmed"""
+IDLE_TIME = 5 * 60
+"""how many of the most recently visited shows are warmed"""
+MAX_VISITED = 10
+
+LOCK_TIMEOUT = 5
+
+
+class Budget(object):
+    '''limits to the work done when warming the caches'''
+
+    def __init__(self, maxRequests, maxBytes, maxSeconds):
+        '''create a budget, starting now
+        @param maxRequests: the most http requests to make
+        @param maxBytes: the most bytes to read
+        @param maxSeconds: the most time to take'''
+        self.maxRequests = maxRequests
+        self.maxBytes = maxBytes
+        self.deadline = time.time() + maxSeconds
+        self.usage = deadlines.Usage()
+
+    def charge(self, requests=1):
+        '''count requests that are not measured by deadlines (ie: metadata lookups)
+        @param requests: the number of requests'''
+        self.usage.requests += requests
+
+    def isSpent(self):
+        '''check if the budget is spent
+        @return: true if no more work should be done'''
+        return self.usage.requests >= self.maxRequests or self.usage.bytes >= self.maxBytes or \
+               time.time() >= self.deadline
+
+
+def getBudget():
+    '''get the budget configured in the settings
+    @return: a new Budget'''
+    return Budget(int(settings.get("warm-max-requests") or 50),
+                  int(settings.get("warm-max-megabytes") or 10) * 1024 * 1024,
+                  int(settings.get("warm-max-minutes") or 5) * 60)
+
+
+def schedule(cancelled, warm):
+    '''warm the caches once a day, when it is time and XBMC is idle, until cancelled (a background task)
+    @param cancelled: the event set when this task is cancelled
+    @param warm: the function that warms the caches, called with the cancellation event and the Budget'''
+    while not background.sleep(cancelled, CHECK_INTERVAL):
+        if not settings.isSet("warm-caches") or not _isDue() or not _isIdle():
+            continue
+        budget = getBudget()
+        start = time.time()
+        log.info("warming the caches")
+        deadlines.measure(budget.usage)
+        try:
+            warm(cancelled, budget)
+        except:
+            log.exception("Failed to warm the caches")
+        finally:
+            deadlines.measure(None)
+            deadlines.saveStats()
+        log.info("warmed the caches with %d requests, %d bytes in %ds", budget.usage.requests, budget.usage.bytes,
+                 time.time() - start)
+        _setLastRun(datetime.date.today())
+
+
+def _isDue():
+    now = datetime.datetime.now()
+    try:
+        hour = int(settings.get("warm-after-hour"))
+    except ValueError:
+        hour = 0
+    return now.hour >= hour and _getLastRun() != now.date()
+
+
+def _isIdle():
+    return xbmc.getGlobalIdleTime() >= IDLE_TIME and not xbmc.Player().isPlaying()
+
+
+def _getLastRun():
+    return _read(storage.getPath("warming", "lastrun.pickle"))
+
+
+def _setLastRun(date):
+    path = storage.getPath("warming", "lastrun.pickle")
+    if path:
+        storage.writeAtomically(path, cPickle.dumps(date, cPickle.HIGHEST_PROTOCOL))
+
+
+def rememberVisit(url, name):
+    '''remember that the user visited a show, to warm its listing
+    @param url: the url of the show
+    @param name: the name of the show'''
+    path = storage.getPath("warming", "visited.pickle")
+    if not path:
+        return
+    try:
+        with filelock.FileLock(path + ".lock", LOCK_TIMEOUT):
+            visited = _read(path) or []
+            if visited and visited[0][0] == url:
+                return
+            visited = [(url, name)] + [show for show in visited if show[0] != url]
+            storage.writeAtomically(path, cPickle.dumps(visited[:MAX_VISITED], cPickle.HIGHEST_PROTOCOL))
+    except (filelock.LockTimeout, IOError, OSError):
+        log.exception("Failed to remember the visit to '%s'", url)
+
+
+def getVisited():
+    '''get the shows the user visited most recently
+    @return: a list of (url, name) of the shows, the most recent first'''
+    return _read(storage.getPath("warming", "visited.pickle")) or []
+
+
+def _read(path):
+    if not path or not os.path.isfile(path):
+        return None
+    try:
+        input = open(path, 'rb')
+        try:
+            return cPickle.load(input)
+        finally:
+            input.close()
+    except (IOError, EOFError, cPickle.UnpicklingError):
+        log.exception("Failed to read '%s'", path)
+        return None